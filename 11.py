@@ -1,4 +1,5 @@
 import os
+from collections import namedtuple
 from flask import Flask, request, abort
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
@@ -6,9 +7,12 @@ from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, PostbackEvent, PostbackAction,
     QuickReply, QuickReplyButton, MessageAction, ButtonsTemplate, TemplateSendMessage
 )
-import requests
-import yfinance as yf
-from bs4 import BeautifulSoup
+import http_client
+from ttl_cache import TTLCache
+from session_store import create_store
+from dedupe import EventDeduper
+from router import Router, TEXT, NUMBER
+from reply_templates import ReplyTemplates, reply
 
 app = Flask(__name__)
 
@@ -16,9 +20,20 @@ app = Flask(__name__)
 line_channel_access_token = os.getenv('CHANNEL_ACCESS_TOKEN')
 line_channel_secret = os.getenv('CHANNEL_SECRET')
 
-line_bot_api = LineBotApi(line_channel_access_token)
+line_bot_api = LineBotApi(line_channel_access_token, endpoint=http_client.LINE_API_ENDPOINT, timeout=http_client.DEFAULT_TIMEOUT, http_client=http_client.SessionHttpClient)
 handler = WebhookHandler(line_channel_secret)
 
+# Webhook event IDs already handled; LINE redeliveries are dropped before any handler runs
+deduper = EventDeduper()
+
+# Stock quote cache; slightly stale quotes are served while refreshing in the background
+quote_cache = TTLCache(
+    "quote",
+    ttl=int(os.getenv('QUOTE_CACHE_TTL', '60')),
+    stale_ttl=int(os.getenv('QUOTE_CACHE_STALE', '300')),
+    max_entries=int(os.getenv('QUOTE_CACHE_SIZE', '256'))
+)
+
 # Finance quiz questions and answers
 questions = [
     {"question": "1. 股票市場中，代表股價指數的英文縮寫是什麼？", "options": ["A) ROI", "B) GDP", "C) EPS", "D) Index"], "answer": "D", "explanation": "股價指數的英文縮寫是 Index。"},
@@ -33,9 +48,14 @@ questions = [
     {"question": "10. 什麼是財務報表中的資產負債表？", "options": ["A) 顯示公司的收益和支出", "B) 顯示公司的現金流量", "C) 顯示公司的財務狀況", "D) 顯示公司的所有者權益"], "answer": "C", "explanation": "資產負債表顯示公司的財務狀況。"}
 ]
 
-# User score and state records
-user_scores = {}
-user_states = {}
+# Quiz progress and pending currency conversions, kept as compact tuples instead of dicts
+UserScore = namedtuple(
+    "UserScore", "score current_question amount from_currency to_currency", defaults=(None, None, None, None, None)
+)
+ConversationState = namedtuple("ConversationState", "step question", defaults=(None, None))
+# User score and state records; shared across workers when SESSION_STORE is sqlite
+user_scores = create_store("user_scores", record=UserScore)
+user_states = create_store("user_states", record=ConversationState)
 
 # Exchange rates
 exchange_rates = {
@@ -67,10 +87,11 @@ def get_financial_news():
     url = 'https://finance.yahoo.com/'
     financial_keywords = ['finance', 'financial', 'market', 'stock', 'economy', 'investment', 'money', 'business']
 
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code != 200:
         return None
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(response.content, 'html.parser')
     links = soup.find_all('a')
 
@@ -98,208 +119,228 @@ def callback():
 
     return 'OK'
 
+router = Router()
+templates = ReplyTemplates()
+
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
+    if not deduper.is_new(event):
+        return
     user_id = event.source.user_id
     text = event.message.text.strip()
+    state = user_states.get(user_id, ConversationState())
 
-    if text == "理財測驗":
-        show_quiz_menu(event.reply_token)
-    elif text in ["第一題", "第二題", "第三題", "第四題", "第五題", "第六題", "第七題", "第八題", "第九題", "第十題"]:
-        question_index = int(text[1:-1]) - 1
-        user_states[user_id] = f"quiz_{question_index}"
-        send_question(event.reply_token, question_index)
-    elif user_states.get(user_id, "").startswith("quiz_"):
-        question_index = int(user_states[user_id].split("_")[1])
-        handle_quiz_answer(event.reply_token, user_id, question_index, text)
-    elif text == "匯率轉換":
-        user_states[user_id] = "currency_conversion_amount"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="請輸入金額，例如：100")
-        )
-    elif text == "股票查詢":
-        user_states[user_id] = "stock_selection"
-        ask_stock(event.reply_token)
-    elif text == "股票資訊":
-       line_bot_api.reply_message(
-           event.reply_token,
-           TextSendMessage(text="請輸入股票代碼，例如：AAPL")
-       )
-       user_states[user_id] = "stock_info"
-    elif user_states.get(user_id) == "stock_info":
-        try:
-            stock_info = get_stock_info(text)
-            reply_message = (f"股票名稱: {stock_info['name']}\n"
-                          f"市場: {stock_info['market']}\n"
-                          f"行業: {stock_info['industry']}\n"
-                          f"市值: {stock_info['market_cap']}\n"
-                          f"股息率: {stock_info['dividend_yield']}")
-        except Exception as e:
-            reply_message = f"獲取股票資訊時出錯: {e}"
-    
-        line_bot_api.reply_message(
-           event.reply_token,
-           TextSendMessage(text=reply_message)
-        )
-        user_states[user_id] = None
-        
-    elif user_states.get(user_id) == "currency_conversion_amount":
-        try:
-            amount = float(text)
-            user_scores[user_id] = {"amount": amount}
-            user_states[user_id] = "currency_conversion_from"
-            ask_currency(event.reply_token, "請選擇來源貨幣", "from_currency")
-        except ValueError:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="請輸入有效的金額，例如：100")
-            )
-    elif user_states.get(user_id) == "currency_conversion_from":
-        user_scores[user_id]["from_currency"] = text
-        user_states[user_id] = "currency_conversion_to"
-        ask_currency(event.reply_token, "請選擇目標貨幣", "to_currency")
-    elif user_states.get(user_id) == "currency_conversion_to":
-        user_scores[user_id]["to_currency"] = text
-        amount = user_scores[user_id]["amount"]
-        from_currency = user_scores[user_id]["from_currency"]
-        to_currency = text
-        
-        converted_amount, error = convert_currency(amount, from_currency, to_currency)
-        if error:
-            reply_text = error
-        else:
-            reply_text = f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
-
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=reply_text)
-        )
-        # Reset state for next conversion
-        user_states[user_id] = None
-        user_scores[user_id] = {}
-    elif text == "財經新聞":
-        news_links = get_financial_news()
-        if news_links:
-            news_message = "\n".join(news_links)
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=f"最新的財經新聞：\n{news_message}")
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="抱歉，無法獲取財經新聞。")
-            )
-    else:
-        show_main_menu(event.reply_token)
+    messages = router.dispatch_message(event, text, state, state.step)
+    if messages:
+        reply(line_bot_api, event.reply_token, messages)
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
-    user_id = event.source.user_id
-    postback_data = event.postback.data
-
-    if postback_data.startswith("from_currency"):
-        currency = postback_data.split("=")[1]
-        user_scores[user_id]["from_currency"] = currency
-        user_states[user_id] = "currency_conversion_to"
-        ask_currency(event.reply_token, "請選擇目標貨幣", "to_currency")
-    elif postback_data.startswith("to_currency"):
-        currency = postback_data.split("=")[1]
-        user_scores[user_id]["to_currency"] = currency
-        amount = user_scores[user_id]["amount"]
-        from_currency = user_scores[user_id]["from_currency"]
-        to_currency = currency
-        
-        converted_amount, error = convert_currency(amount, from_currency, to_currency)
-        if error:
-            reply_text = error
-        else:
-            reply_text = f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
-
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=reply_text)
-        )
-        # Reset state for next conversion
-        user_states[user_id] = None
-        user_scores[user_id] = {}
-
-    elif user_id not in user_scores:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請輸入 '理財測驗' 來開始測驗。"))
+    if not deduper.is_new(event):
         return
-    question_index = user_scores[user_id]["current_question"]
+    messages = router.dispatch_postback(event, event.postback.data)
+    if messages:
+        reply(line_bot_api, event.reply_token, messages)
+
+def format_conversion(amount, from_currency, to_currency):
+    converted_amount, error = convert_currency(amount, from_currency, to_currency)
+    if error:
+        return error
+    return f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
+
+@router.command("理財測驗")
+def show_quiz_menu(event, text, state):
+    return templates.get("quiz_menu")
+
+def build_quiz_menu():
+    quick_reply_buttons = [
+        QuickReplyButton(action=MessageAction(label=f"第{index + 1}題", text=f"第{index + 1}題")) for index in range(len(questions))
+    ]
+    quick_reply = QuickReply(items=quick_reply_buttons)
+    return TextSendMessage(text="請選擇問題：", quick_reply=quick_reply)
+
+# Both the menu labels ("第1題") and the written-out numerals ("第一題") pick a question
+quiz_picks = {f"第{index + 1}題": index for index in range(len(questions))}
+quiz_picks.update({f"第{numeral}題": index for index, numeral in enumerate("一二三四五六七八九十")})
+
+@router.command(*quiz_picks)
+def pick_question(event, text, state):
+    question_index = quiz_picks[text]
+    user_states.set(event.source.user_id, ConversationState(step="quiz", question=question_index))
+    return send_question(question_index)
+
+@router.state("quiz")
+def answer_question(event, text, state):
+    return handle_quiz_answer(state.question, text)
+
+@router.command("匯率轉換")
+def start_currency_conversion(event, text, state):
+    user_states.set(event.source.user_id, ConversationState(step="currency_conversion_amount"))
+    return TextSendMessage(text="請輸入金額，例如：100")
+
+@router.state("currency_conversion_amount", NUMBER)
+def receive_amount(event, text, state):
+    user_id = event.source.user_id
+    user_scores.set(user_id, UserScore(amount=float(text)))
+    user_states.set(user_id, ConversationState(step="currency_conversion_from"))
+    return ask_currency("請選擇來源貨幣", "from_currency")
+
+@router.state("currency_conversion_amount", TEXT)
+def reject_amount(event, text, state):
+    return TextSendMessage(text="請輸入有效的金額，例如：100")
+
+@router.state("currency_conversion_from")
+def receive_from_currency(event, text, state):
+    user_id = event.source.user_id
+    user_scores.merge(user_id, from_currency=text)
+    user_states.set(user_id, ConversationState(step="currency_conversion_to"))
+    return ask_currency("請選擇目標貨幣", "to_currency")
+
+@router.state("currency_conversion_to")
+def receive_to_currency(event, text, state):
+    user_id = event.source.user_id
+    conversion = user_scores.merge(user_id, to_currency=text)
+    reply_text = format_conversion(conversion.amount, conversion.from_currency, text)
+    # Reset state for next conversion
+    user_states.delete(user_id)
+    user_scores.delete(user_id)
+    return TextSendMessage(text=reply_text)
+
+@router.command("股票查詢")
+def ask_stock(event, text, state):
+    user_states.set(event.source.user_id, ConversationState(step="stock_selection"))
+    return templates.get("ask_stock")
+
+def build_ask_stock():
+    quick_reply_buttons = [
+        QuickReplyButton(action=MessageAction(label="Apple", text="AAPL")),
+        QuickReplyButton(action=MessageAction(label="Google", text="GOOGL")),
+        QuickReplyButton(action=MessageAction(label="Microsoft", text="MSFT")),
+        # Additional options can be added here
+    ]
+    quick_reply = QuickReply(items=quick_reply_buttons)
+    return TextSendMessage(text="請選擇或輸入股票代碼，例如：AAPL", quick_reply=quick_reply)
+
+@router.command("股票資訊")
+def ask_stock_ticker(event, text, state):
+    user_states.set(event.source.user_id, ConversationState(step="stock_info"))
+    return TextSendMessage(text="請輸入股票代碼，例如：AAPL")
+
+@router.state("stock_selection")
+@router.state("stock_info")
+def send_stock_info(event, text, state):
+    try:
+        stock_info = get_stock_info(text)
+        reply_message = (f"股票名稱: {stock_info['name']}\n"
+                      f"市場: {stock_info['market']}\n"
+                      f"行業: {stock_info['industry']}\n"
+                      f"市值: {stock_info['market_cap']}\n"
+                      f"股息率: {stock_info['dividend_yield']}")
+    except Exception as e:
+        reply_message = f"獲取股票資訊時出錯: {e}"
+
+    user_states.delete(event.source.user_id)
+    return TextSendMessage(text=reply_message)
+
+@router.command("財經新聞")
+def send_financial_news(event, text, state):
+    news_links = get_financial_news()
+    if news_links:
+        news_message = "\n".join(news_links)
+        return TextSendMessage(text=f"最新的財經新聞：\n{news_message}")
+    return TextSendMessage(text="抱歉，無法獲取財經新聞。")
+
+@router.fallback
+def show_main_menu(event, text, state):
+    return templates.get("main_menu")
+
+def build_main_menu():
+    buttons_template = ButtonsTemplate(
+        title='主選單',
+        text='請選擇功能',
+        actions=[
+            MessageAction(label='理財測驗', text='理財測驗'),
+            MessageAction(label='匯率轉換', text='匯率轉換'),
+            MessageAction(label='財經新聞', text='財經新聞'),
+            MessageAction(label='股票查詢', text='股票查詢')
+        ]
+    )
+    return TemplateSendMessage(alt_text='主選單', template=buttons_template)
+
+@router.postback("from_currency")
+def choose_from_currency(event, currency):
+    user_id = event.source.user_id
+    user_scores.merge(user_id, from_currency=currency)
+    user_states.set(user_id, ConversationState(step="currency_conversion_to"))
+    return ask_currency("請選擇目標貨幣", "to_currency")
+
+@router.postback("to_currency")
+def choose_to_currency(event, currency):
+    user_id = event.source.user_id
+    conversion = user_scores.merge(user_id, to_currency=currency)
+    reply_text = format_conversion(conversion.amount, conversion.from_currency, currency)
+    # Reset state for next conversion
+    user_states.delete(user_id)
+    user_scores.delete(user_id)
+    return TextSendMessage(text=reply_text)
+
+@router.postback_fallback
+def score_answer(event, postback_data):
+    user_id = event.source.user_id
+    if user_scores.get(user_id) is None:
+        return TextSendMessage(text="請輸入 '理財測驗' 來開始測驗。")
+
+    # Score and advance in one atomic read-modify-write
+    scores = user_scores.update(user_id, lambda scores: scores._replace(
+        score=scores.score + (postback_data == questions[scores.current_question]["answer"]),
+        current_question=scores.current_question + 1
+    ))
+    question_index = scores.current_question - 1
     if postback_data == questions[question_index]["answer"]:
-        user_scores[user_id]["score"] += 1
         response_text = "答對了！"
     else:
         response_text = f"答錯了，正確答案是：{questions[question_index]['answer']}"
 
-    user_scores[user_id]["current_question"] += 1
-    if user_scores[user_id]["current_question"] < len(questions):
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-        send_question(event.reply_token, user_id)
-    else:
-        final_score = user_scores[user_id]["score"]
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"{response_text}\n測驗結束！你總共答對了 {final_score} 題。"))
+    if scores.current_question < len(questions):
+        return [TextSendMessage(text=response_text), send_question(scores.current_question)]
+    final_score = scores.score
+    return TextSendMessage(text=f"{response_text}\n測驗結束！你總共答對了 {final_score} 題。")
+
+def send_question(question_index):
+    return templates.get("question", question_index)
 
-def send_question(reply_token, question_index):
+def build_question(question_index):
     question = questions[question_index]["question"]
     options = questions[question_index]["options"]
 
     actions = [QuickReplyButton(action=PostbackAction(label=option, data=option[0])) for option in options]
     quick_reply = QuickReply(items=actions[:4])  # LINE quick reply button limit
+    return TextSendMessage(text=question, quick_reply=quick_reply)
 
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text=question, quick_reply=quick_reply)
-    )
-
-def handle_quiz_answer(reply_token, user_id, question_index, answer):
+def handle_quiz_answer(question_index, answer):
     if answer[0] == questions[question_index]["answer"]:
         response_text = "答對了！"
     else:
         correct_answer = questions[question_index]["answer"]
         explanation = questions[question_index]["explanation"]
         response_text = f"答錯了，正確答案是：{correct_answer}\n{explanation}"
-    line_bot_api.reply_message(reply_token, TextSendMessage(text=response_text))
+    return TextSendMessage(text=response_text)
 
-def show_quiz_menu(reply_token):
-    quick_reply_buttons = [
-        QuickReplyButton(action=MessageAction(label=f"第{index + 1}題", text=f"第{index + 1}題")) for index in range(len(questions))
-    ]
-    quick_reply = QuickReply(items=quick_reply_buttons)
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text="請選擇問題：", quick_reply=quick_reply)
-    )
+def ask_currency(text, prefix):
+    return templates.get("ask_currency", text, prefix)
 
-def ask_currency(reply_token, text, prefix):
+def build_ask_currency(text, prefix):
     currencies = list(exchange_rates.keys())
     actions = [QuickReplyButton(action=PostbackAction(label=currency, data=f"{prefix}={currency}")) for currency in currencies]
     quick_reply = QuickReply(items=actions[:13])  # LINE quick reply button limit
-    
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text=text, quick_reply=quick_reply)
-    )
-    
-def ask_stock(reply_token):
-    quick_reply_buttons = [
-        QuickReplyButton(action=MessageAction(label="Apple", text="AAPL")),
-        QuickReplyButton(action=MessageAction(label="Google", text="GOOGL")),
-        QuickReplyButton(action=MessageAction(label="Microsoft", text="MSFT")),
-        # Additional options can be added here
-    ]
-    quick_reply = QuickReply(items=quick_reply_buttons)
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text="請選擇或輸入股票代碼，例如：AAPL", quick_reply=quick_reply)
-    )
+    return TextSendMessage(text=text, quick_reply=quick_reply)
+
+def fetch_stock_info(ticker_symbol):
+    import yfinance as yf
+    return yf.Ticker(ticker_symbol).info
 
 def get_stock_info(ticker_symbol):
-    stock = yf.Ticker(ticker_symbol)
-    info = stock.info
+    info = quote_cache.get(ticker_symbol.strip().upper(), fetch_stock_info)
     stock_info = {
         'name': info.get('longName', 'N/A'),
         'market': info.get('market', 'N/A'),
@@ -309,19 +350,18 @@ def get_stock_info(ticker_symbol):
     }
     return stock_info
 
-def show_main_menu(reply_token):
-    buttons_template = ButtonsTemplate(
-        title='主選單',
-        text='請選擇功能',
-        actions=[
-            MessageAction(label='理財測驗', text='理財測驗'),
-            MessageAction(label='匯率轉換', text='匯率轉換'),
-            MessageAction(label='財經新聞', text='財經新聞'),
-            MessageAction(label='股票查詢', text='股票查詢')
-        ]
-    )
-    message = TemplateSendMessage(alt_text='主選單', template=buttons_template)
-    line_bot_api.reply_message(reply_token, message)
+# Static replies are built and serialized once at startup; they are rebuilt
+# automatically when the currency list or the number of questions changes
+templates.register("main_menu", build_main_menu)
+templates.register("quiz_menu", build_quiz_menu, version=lambda: len(questions))
+templates.register("question", build_question, version=lambda: len(questions))
+templates.register("ask_stock", build_ask_stock)
+templates.register("ask_currency", build_ask_currency, version=lambda: tuple(exchange_rates))
+templates.get("main_menu")
+templates.get("quiz_menu")
+templates.get("ask_stock")
+templates.get("ask_currency", "請選擇來源貨幣", "from_currency")
+templates.get("ask_currency", "請選擇目標貨幣", "to_currency")
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,5 +1,6 @@
 import os
-import requests
+import http_client
+from rates import RateProvider
 from flask import Flask, request, abort
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
@@ -11,7 +12,7 @@ from linebot.models import (
 app = Flask(__name__)
 
 # 設置你的LINE BOT的Channel Access Token 和 Channel Secret
-line_bot_api = LineBotApi('+m9MsMlBbX6xUkenrdglsJ4dui9Iv1SKwaAQQSBqHA2yGAibmFDqR6Dh6utNRj/QDJ6vRZe3sFN2SEHDLzC4d/1v+ieyXfS3rMLXNMkay13yBp1A8waU8PkCaPgpWmL5XZ56NDsilEo8NXO4NE9EFwdB04t89/1O/w1cDnyilFU=')
+line_bot_api = LineBotApi('+m9MsMlBbX6xUkenrdglsJ4dui9Iv1SKwaAQQSBqHA2yGAibmFDqR6Dh6utNRj/QDJ6vRZe3sFN2SEHDLzC4d/1v+ieyXfS3rMLXNMkay13yBp1A8waU8PkCaPgpWmL5XZ56NDsilEo8NXO4NE9EFwdB04t89/1O/w1cDnyilFU=', endpoint=http_client.LINE_API_ENDPOINT, timeout=http_client.DEFAULT_TIMEOUT, http_client=http_client.SessionHttpClient)
 handler = WebhookHandler('1a1abae950e5754d3011ae1c24ce6650')
 
 # 理財測驗題目和答案
@@ -42,19 +43,45 @@ exchange_rates = {
     # 可以增加更多貨幣
 }
 
+def parse_cbc_rates(data):
+    # BP01D01 是新台幣對美元銀行間收盤匯率（日資料），每一列為 [日期, 匯率]
+    # 只取最新一天的匯率換算成以美金為 1 的 TWD，其他貨幣沿用固定匯率
+    rows = (data.get("data") or {}).get("dataSets") if isinstance(data, dict) else None
+    latest = None
+    for row in rows or []:
+        if not isinstance(row, (list, tuple)) or len(row) < 2:
+            continue
+        try:
+            rate = float(str(row[-1]).replace(",", ""))
+        except ValueError:
+            continue
+        day = str(row[0]).replace("/", "").replace("-", "")
+        if rate > 0 and (latest is None or day > latest[0]):
+            latest = (day, rate)
+    if latest is None:
+        return None
+    return {"TWD": latest[1]}
+
+# 中央銀行的匯率資訊，在背景定期更新，抓取失敗時顯示固定匯率
+central_bank_rates = RateProvider(
+    "cbc",
+    os.getenv('CBC_RATES_URL', "https://cpx.cbc.gov.tw/API/DataAPI/Get?FileName=BP01D01"),
+    parse_cbc_rates,
+    exchange_rates,
+    interval=int(os.getenv('RATES_REFRESH_INTERVAL', '3600'))
+)
+
 # 獲取中央銀行的匯率資訊
 def get_central_bank_exchange_rates():
-    # 假設中央銀行提供的API是https://example.com/exchange_rates
-    response = requests.get("https://cpx.cbc.gov.tw/API/DataAPI/Get?FileName=BP01D01")
-    data = response.json()
-    return data
+    return central_bank_rates.rates()
 
 def convert_currency(amount, from_currency, to_currency):
-    if from_currency not in exchange_rates or to_currency not in exchange_rates:
+    rates = central_bank_rates.rates()
+    if from_currency not in rates or to_currency not in rates:
         return None, "Unsupported currency"
     
-    from_rate = exchange_rates[from_currency]
-    to_rate = exchange_rates[to_currency]
+    from_rate = rates[from_currency]
+    to_rate = rates[to_currency]
     converted_amount = amount * (to_rate / from_rate)
     return converted_amount, None
 
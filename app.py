@@ -1,24 +1,114 @@
+import functools
 import os
-from flask import Flask, request, abort
+import threading
+from collections import namedtuple
+from urllib.parse import quote
+from flask import Flask, Response, request, abort, jsonify, make_response, has_request_context
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, PostbackEvent, PostbackAction,
-    QuickReply, QuickReplyButton, MessageAction, ButtonsTemplate, TemplateSendMessage
+    QuickReply, QuickReplyButton, MessageAction, ButtonsTemplate, TemplateSendMessage, ImageSendMessage
 )
-import yfinance as yf
-import requests
-from bs4 import BeautifulSoup
+import http_client
+import metrics
+from metrics import Counter, Histogram, track
+from scheduler import PeriodicTask
+from worker_pool import WorkerPool
+from ttl_cache import TTLCache
+from news_feed import NewsFeed
+from session_store import create_store
+from router import Router, TEXT, NUMBER
+from rates import RateProvider
+from cross_rates import CrossRateCache
+from dedupe import EventDeduper
+from rate_limit import RateLimiter, ConcurrencyLimit
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from charts import PERIODS, parse_day, render_chart, trading_day
+from process_pool import ProcessPool, PoolBusy
+from reply_templates import ReplyTemplates, reply, push
+from reply_deadline import ReplyBudget
+import profiling
 
 app = Flask(__name__)
 
+# 只有設定 PROFILE_SAMPLE_RATE 或 PROFILE_TOKEN 時才會掛上 profiling hook
+profiler = profiling.RequestProfiler(
+    profiling.PROFILE_DIR,
+    sample_rate=profiling.PROFILE_SAMPLE_RATE,
+    routes=profiling.PROFILE_ROUTES,
+    token=profiling.PROFILE_TOKEN,
+    keep=profiling.PROFILE_KEEP
+)
+profiler.install(app)
+
 # 設置你的LINE BOT的Channel Access Token 和 Channel Secret
 line_channel_access_token = os.getenv('CHANNEL_ACCESS_TOKEN')
 line_channel_secret = os.getenv('CHANNEL_SECRET')
 
-line_bot_api = LineBotApi(line_channel_access_token)
+line_bot_api = LineBotApi(line_channel_access_token, endpoint=http_client.LINE_API_ENDPOINT, timeout=http_client.DEFAULT_TIMEOUT, http_client=http_client.SessionHttpClient)
 handler = WebhookHandler(line_channel_secret)
 
+# 設為 1 時 /callback 先回 200，事件交給背景工作池處理
+webhook_async = os.getenv('WEBHOOK_ASYNC', '0') == '1'
+webhook_pool = WorkerPool(
+    "webhook",
+    workers=int(os.getenv('WEBHOOK_WORKERS', '4')),
+    max_queue=int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+)
+
+# 已處理過的 webhookEventId，重送的事件在進入任何處理之前就丟掉
+deduper = EventDeduper()
+
+# 外部服務的斷路器，錯誤或太慢的比例過高時暫停呼叫，改回舊資料；狀態可在 /status 查看
+breakers = {
+    name: CircuitBreaker(
+        name,
+        slow_call=float(os.getenv('BREAKER_SLOW_CALL', '5')),
+        reset_timeout=int(os.getenv('BREAKER_RESET_TIMEOUT', '30')),
+        ignore=(PoolBusy,)
+    )
+    for name in ("yfinance", "yahoo_news")
+}
+UPSTREAM_DOWN = "Yahoo Finance 暫時無法連線，請稍後再試"
+
+# 股票報價快取，過期後 QUOTE_CACHE_STALE 秒內仍先回舊資料並在背景更新
+quote_cache = TTLCache(
+    "quote",
+    ttl=int(os.getenv('QUOTE_CACHE_TTL', '60')),
+    stale_ttl=int(os.getenv('QUOTE_CACHE_STALE', '300')),
+    max_entries=int(os.getenv('QUOTE_CACHE_SIZE', '256'))
+)
+
+# 多檔股票一起查詢時的日線報價快取，一次查詢最多 MAX_BATCH_TICKERS 檔
+batch_quote_cache = TTLCache(
+    "batch_quote",
+    ttl=int(os.getenv('QUOTE_CACHE_TTL', '60')),
+    stale_ttl=int(os.getenv('QUOTE_CACHE_STALE', '300')),
+    max_entries=int(os.getenv('QUOTE_CACHE_SIZE', '256'))
+)
+MAX_BATCH_TICKERS = int(os.getenv('MAX_BATCH_TICKERS', '10'))
+
+# 畫圖等 CPU 密集的工作交給子行程，CPU_TASK_TIMEOUT 秒沒完成就放棄
+cpu_pool = ProcessPool(
+    "cpu",
+    workers=int(os.getenv('CPU_POOL_WORKERS', '2')),
+    max_pending=int(os.getenv('CPU_POOL_MAX_PENDING', '8')),
+    timeout=int(os.getenv('CPU_TASK_TIMEOUT', '30')),
+    max_tasks_per_child=int(os.getenv('CPU_POOL_MAX_TASKS', '50'))
+)
+
+# 走勢圖快取，key 為 (代碼, 區間, 交易日)，換日後自然失效
+chart_cache = TTLCache(
+    "chart",
+    ttl=int(os.getenv('CHART_CACHE_TTL', '86400')),
+    stale_ttl=0,
+    max_entries=int(os.getenv('CHART_CACHE_SIZE', '64'))
+)
+CHART_MAX_AGE = int(os.getenv('CHART_MAX_AGE', '3600'))
+# LINE 只接受 https 圖片網址，例如 https://your-app.onrender.com
+public_base_url = os.getenv('PUBLIC_BASE_URL', '').rstrip('/')
+
 # 理財小知識
 financial_tips = [
     {"title": "股票市場指數", "content": "股票市場中，代表股價指數的英文縮寫是Index。"},
@@ -33,10 +123,14 @@ financial_tips = [
     {"title": "財務報表中的資產負債表", "content": "資產負債表顯示公司的財務狀況。"}
 ]
 
-# 用戶狀態記錄
-user_states = {}
+# 用戶狀態記錄，SESSION_STORE 設為 sqlite 時可在多個 worker 之間共用
+# 以 namedtuple 取代 dict 保存，每位使用者只佔一個小 tuple
+ConversationState = namedtuple(
+    "ConversationState", "step amount from_currency to_currency", defaults=(None, None, None, None)
+)
+user_states = create_store("user_states", record=ConversationState)
 
-# 固定匯率數據
+# 固定匯率數據，線上匯率抓取失敗時使用，也決定可選擇的貨幣
 exchange_rates = {
     "USD美金": 1,
     "TWD台幣": 30,
@@ -53,24 +147,47 @@ exchange_rates = {
     # 可以增加更多貨幣
 }
 
+def parse_usd_rates(data):
+    # {"rates": {"TWD": 32.1, ...}} 格式，換算成以美金為 1 的匯率表
+    feed = data.get("rates") or {}
+    base = feed.get("USD")
+    if not base:
+        return None
+    return {label: feed[label[:3]] / base for label in exchange_rates if label[:3] in feed}
+
+# 線上匯率，每 RATES_REFRESH_INTERVAL 秒在背景更新一次
+rate_provider = RateProvider(
+    "usd",
+    os.getenv('RATES_SOURCE_URL', 'https://open.er-api.com/v6/latest/USD'),
+    parse_usd_rates,
+    exchange_rates,
+    interval=int(os.getenv('RATES_REFRESH_INTERVAL', '3600'))
+)
+
+# 交叉匯率矩陣，匯率快照更新後第一次使用時才重建
+cross_rates = CrossRateCache(rate_provider)
+
 def convert_currency(amount, from_currency, to_currency):
-    if from_currency not in exchange_rates or to_currency not in exchange_rates:
+    matrix = cross_rates.get()
+    if from_currency not in matrix.index or to_currency not in matrix.index:
         return None, "Unsupported currency"
     
-    from_rate = exchange_rates[from_currency]
-    to_rate = exchange_rates[to_currency]
-    converted_amount = amount * (to_rate / from_rate)
+    converted_amount = matrix.convert(amount, from_currency, to_currency)
     return converted_amount, None
 
-def get_financial_news():
-    url = 'https://finance.yahoo.com/'
-    financial_keywords = ['finance', 'financial', 'market', 'stock', 'economy', 'investment', 'money', 'business']
+def convert_to_all(amount, from_currency):
+    # 一次換算成所有支援的貨幣，from_currency 可以是 "USD"、"美金" 或 "USD美金"
+    matrix = cross_rates.get()
+    currency = matrix.resolve(from_currency)
+    if currency is None:
+        return currency, None, "Unsupported currency"
+    return currency, matrix.convert_all(amount, currency), None
 
-    response = requests.get(url)
-    if response.status_code != 200:
-        return None
+def parse_financial_news(content):
+    financial_keywords = ['finance', 'financial', 'market', 'stock', 'economy', 'investment', 'money', 'business']
 
-    soup = BeautifulSoup(response.content, 'html.parser')
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
     links = soup.find_all('a')
 
     news_links = []
@@ -84,163 +201,442 @@ def get_financial_news():
     
     return news_links[:5]
 
+# 財經新聞快照，每 NEWS_REFRESH_INTERVAL 秒在背景更新一次
+news_feed = NewsFeed(
+    'https://finance.yahoo.com/',
+    parse_financial_news,
+    interval=int(os.getenv('NEWS_REFRESH_INTERVAL', '300')),
+    breaker=breakers["yahoo_news"]
+)
+
+def get_financial_news():
+    return news_feed.latest()
+
+def fetch_stock_info(ticker):
+    import yfinance as yf
+    with track("yfinance_info"):
+        return yf.Ticker(ticker).info
+
 def get_stock_info(ticker):
+    ticker = ticker.strip().upper()
     try:
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        return (f"公司名稱: {info.get('longName', 'N/A')}\n"
-                f"市場價格: {info.get('currentPrice', 'N/A')}\n"
-                f"市值: {info.get('marketCap', 'N/A')}\n"
-                f"行業: {info.get('industry','N/A')}\n"
-                f"現價: {info.get('currentPrice')}\n"
-                f"52週最高價: {info.get('fiftyTwoWeekHigh', 'N/A')}\n"
-                f"52週最低價: {info.get('fiftyTwoWeekLow', 'N/A')}\n"
-                f"市盈率(TTM): {info.get('trailingPE', 'N/A')}\n"
-                f"股息率: {info.get('dividendYield', 'N/A')}")
+        info = quote_cache.get(ticker, lambda key: breakers["yfinance"].call(fetch_stock_info, key))
+        return format_stock_info(info)
+    except CircuitOpen:
+        info = quote_cache.peek(ticker)
+        if info is None:
+            return UPSTREAM_DOWN
+        return f"{format_stock_info(info)}\n（Yahoo Finance 暫時無法連線，以上為先前的資料）"
     except Exception as e:
         return f"無法獲取股票資訊: {str(e)}"
 
+def format_stock_info(info):
+    return (f"公司名稱: {info.get('longName', 'N/A')}\n"
+            f"市場價格: {info.get('currentPrice', 'N/A')}\n"
+            f"市值: {info.get('marketCap', 'N/A')}\n"
+            f"行業: {info.get('industry','N/A')}\n"
+            f"現價: {info.get('currentPrice')}\n"
+            f"52週最高價: {info.get('fiftyTwoWeekHigh', 'N/A')}\n"
+            f"52週最低價: {info.get('fiftyTwoWeekLow', 'N/A')}\n"
+            f"市盈率(TTM): {info.get('trailingPE', 'N/A')}\n"
+            f"股息率: {info.get('dividendYield', 'N/A')}")
+
+def parse_tickers(text):
+    # "AAPL MSFT, googl" -> ["AAPL", "MSFT", "GOOGL"]，重複的代碼只查一次
+    tickers = []
+    for ticker in text.replace("，", " ").replace(",", " ").upper().split():
+        if ticker not in tickers:
+            tickers.append(ticker)
+    return tickers[:MAX_BATCH_TICKERS]
+
+def fetch_quotes(tickers):
+    # 一次 yf.download 取回所有代碼最近幾天的日線，不必每檔各查一次
+    import yfinance as yf
+    with track("yfinance_download"):
+        frame = yf.download(
+            tickers, period="5d", interval="1d", group_by="ticker",
+            auto_adjust=False, progress=False, threads=False
+        )
+    quotes = {}
+    for ticker in tickers:
+        if ticker not in frame.columns.get_level_values(0):
+            quotes[ticker] = None
+            continue
+        closes = frame[ticker]["Close"].dropna()
+        if closes.empty:
+            quotes[ticker] = None
+            continue
+        price = float(closes.iloc[-1])
+        previous = float(closes.iloc[-2]) if len(closes) > 1 else price
+        quotes[ticker] = {
+            "price": price,
+            "change": (price / previous - 1) * 100 if previous else 0.0,
+            "volume": int(frame[ticker]["Volume"].fillna(0).iloc[-1]),
+        }
+    return quotes
+
+def get_stock_quotes(tickers):
+    lines = ["代碼  收盤價  漲跌幅  成交量"]
+    try:
+        quotes = batch_quote_cache.get_many(tickers, lambda keys: breakers["yfinance"].call(fetch_quotes, keys))
+    except CircuitOpen:
+        quotes = {ticker: batch_quote_cache.peek(ticker) for ticker in tickers}
+        if not any(quotes.values()):
+            return UPSTREAM_DOWN
+        lines.insert(0, "（Yahoo Finance 暫時無法連線，以下為先前的資料）")
+    except Exception as e:
+        return f"無法獲取股票資訊: {str(e)}"
+    for ticker in tickers:
+        quote = quotes.get(ticker)
+        if quote is None:
+            lines.append(f"{ticker}  查無資料")
+        else:
+            lines.append(f"{ticker}  {quote['price']:,.2f}  {quote['change']:+.2f}%  {quote['volume']:,}")
+    return "\n".join(lines)
+
+def get_chart(ticker, period, day=None):
+    return chart_cache.get(
+        (ticker, period, day or trading_day()),
+        lambda key: breakers["yfinance"].call(render_chart_in_pool, key[0], key[1], key[2])
+    )
+
+def render_chart_in_pool(ticker, period, day):
+    with track("chart_render"):
+        return cpu_pool.run(render_chart, ticker, period, day)
+
+def chart_urls(ticker, period, chart):
+    # 沒設定 PUBLIC_BASE_URL 時用請求的 host；代理後面 request.url_root 會是 http://，LINE 不收，一律用 https
+    base_url = public_base_url or (f"https://{request.host}" if has_request_context() else '')
+    if not base_url:
+        return None
+    # 網址帶上圖檔雜湊，圖更新後 LINE 不會沿用舊的快取
+    path = f"{base_url}/charts/{quote(ticker, safe='')}/{period}/{trading_day()}"
+    version = chart.etag[:12]
+    return f"{path}/image.png?v={version}", f"{path}/preview.png?v={version}"
+
+@app.route("/charts/<ticker>/<period>/<day>/<kind>.png", methods=['GET'])
+def chart_image(ticker, period, day, kind):
+    # 聊天室裡的舊圖片在使用者點開時才會下載，過去交易日的網址也要能用；快取裡沒有時在這裡補畫
+    if period not in PERIODS or kind not in ("image", "preview") or parse_day(day) is None:
+        abort(404)
+    try:
+        chart = get_chart(ticker.upper(), period, day)
+    except (PoolBusy, CircuitOpen):
+        return make_response("busy", 503, {"Retry-After": "5"})
+    except TimeoutError:
+        abort(504)
+    if chart is None:
+        abort(404)
+
+    response = make_response(chart.image if kind == "image" else chart.preview)
+    response.mimetype = "image/png"
+    response.set_etag(f"{chart.etag}-{kind}")
+    response.cache_control.public = True
+    response.cache_control.max_age = CHART_MAX_AGE
+    return response.make_conditional(request)
+
+# /callback 的處理時間與收到的事件數
+webhook_latency = Histogram()
+webhook_events = Counter()
+
 @app.route("/callback", methods=['POST'])
 def callback():
-    # 獲取 LINE 平台傳來的請求
-    signature = request.headers['X-Line-Signature']
-    body = request.get_data(as_text=True)
+    with webhook_latency.time():
+        # 獲取 LINE 平台傳來的請求
+        signature = request.headers['X-Line-Signature']
+        body = request.get_data(as_text=True)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
+        try:
+            events = handler.parser.parse(body, signature)
+        except InvalidSignatureError:
+            abort(400)
 
+        webhook_events.inc(len(events))
+        process_events(events)
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_message(event):
-    user_id = event.source.user_id
-    text = event.message.text.strip()
+@app.route("/api/convert", methods=['GET'])
+def convert_api():
+    amount = request.args.get('amount', type=float)
+    if amount is None:
+        return jsonify({"error": "amount must be a number"}), 400
+    currency, results, error = convert_to_all(amount, request.args.get('from', 'USD'))
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify({"amount": amount, "from": currency, "rates": dict(results)})
 
-    if text == "理財小知識":
-        send_financial_tip(event.reply_token)
-    elif text == "匯率轉換":
-        user_states[user_id] = "currency_conversion_amount"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="請輸入金額，例如：100")
-        )
-    elif user_states.get(user_id) == "currency_conversion_amount":
-        try:
-            amount = float(text)
-            user_states[user_id] = {"amount": amount}
-            ask_currency(event.reply_token, "請選擇來源貨幣", "from_currency")
-        except ValueError:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="請輸入正確的金額，例如：100")
-            )
-    elif user_states.get(user_id) == "currency_conversion_from":
-        user_states[user_id]["from_currency"] = text
-        ask_currency(event.reply_token, "請選擇目標貨幣", "to_currency")
-    elif user_states.get(user_id) == "currency_conversion_to":
-        user_states[user_id]["to_currency"] = text
-        amount = user_states[user_id]["amount"]
-        from_currency = user_states[user_id]["from_currency"]
-        to_currency = text
-        
-        converted_amount, error = convert_currency(amount, from_currency, to_currency)
-        if error:
-            reply_text = error
-        else:
-            reply_text = f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
+# METRICS_DIR 有設定時每個 worker 定期把自己的數值寫進去，/metrics 加總所有 worker
+metrics_flusher = PeriodicTask("metrics-flush", metrics.flush, metrics.METRICS_FLUSH_INTERVAL)
 
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=reply_text)
-        )
-        # 重置狀態以便下次重新開始匯率轉換
-        user_states[user_id] = None
-    elif text == "財經新聞":
-        news_links = get_financial_news()
-        if news_links:
-            news_message = "\n".join(news_links)
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=f"最新的財經新聞：\n{news_message}")
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="抱歉，無法獲取財經新聞。")
-            )
-    elif text == "股票資訊":
-        user_states[user_id] = "stock_info"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="請輸入股票代碼，例如：AAPL, GOOGL, MSFT, AMZN, FB")
-        )
-    elif user_states.get(user_id) == "stock_info":
-        stock_info = get_stock_info(text)
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=stock_info)
-        )
-        # 重置狀態以便下次重新查詢股票資訊
-        user_states[user_id] = None
-    else:
-        show_main_menu(event.reply_token)
+@app.before_request
+def start_metrics_flusher():
+    if metrics.METRICS_DIR:
+        metrics_flusher.start()
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    metrics.flush()
+    return Response(metrics.render(metrics.aggregate()), mimetype="text/plain; version=0.0.4")
+
+@app.route("/status", methods=['GET'])
+def status():
+    circuits = {name: breaker.stats() for name, breaker in breakers.items()}
+    degraded = [name for name, circuit in circuits.items() if circuit["state"] != "closed"]
+    return jsonify({"status": "degraded" if degraded else "ok", "degraded": degraded, "circuits": circuits})
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({
+        "webhook_pool": webhook_pool.stats(),
+        "quote_cache": quote_cache.stats(),
+        "batch_quote_cache": batch_quote_cache.stats(),
+        "chart_cache": chart_cache.stats(),
+        "cpu_pool": cpu_pool.stats(),
+        "news_feed": news_feed.stats(),
+        "user_states": user_states.stats(),
+        "dedupe": deduper.stats(),
+        "rates": dict(rate_provider.stats(), matrix_rebuilds=cross_rates.rebuilds),
+        "routes": router.stats(),
+        "replies": reply_budget.stats(),
+        "limits": dict(
+            {name: limit.stats() for name, limit in dependency_limits.items()}, user=user_limiter.stats()
+        ),
+        "templates": templates.stats(),
+        "profiler": profiler.stats()
+    })
+
+def warm_up():
+    # 預先載入 yfinance (含 pandas/numpy) 與 BeautifulSoup，並抓好第一份新聞快照
+    import yfinance  # noqa: F401
+    from bs4 import BeautifulSoup  # noqa: F401
+    news_feed.latest()
+
+# 設為 1 時 worker 啟動後在背景預熱，不會延後處理第一個請求
+if os.getenv('WARM_UP', '0') == '1':
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+def event_key(event):
+    # 群組裡沒有 user_id 時以群組為單位排序
+    return getattr(event.source, 'user_id', None) or getattr(event.source, 'sender_id', None)
+
+def push_target(event):
+    # 來不及 reply 時的 push 對象：群組、聊天室送回原本的群組，不是發話者的 1 對 1 聊天
+    return getattr(event.source, 'sender_id', None)
+
+def process_events(events):
+    events = deduper.filter(events)
+    # 同一次送達的多個事件依使用者分散到工作池同時處理，同一位使用者的事件仍依序執行
+    if webhook_async:
+        for event in events:
+            webhook_pool.submit(dispatch_event, event, key=event_key(event))
+    elif len(events) == 1:
+        dispatch_event(events[0])
+    elif events:
+        webhook_pool.map(dispatch_event, events, key=event_key)
+
+def dispatch_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+    elif isinstance(event, PostbackEvent):
+        handle_postback(event)
+
+router = Router()
+templates = ReplyTemplates()
+
+# 每個事件有 REPLY_BUDGET 秒的回覆期限（從 LINE 送出事件起算），查股票、抓新聞來不及時
+# 先回「查詢中…」，結果再用 push_message 送出，避免 reply token 過期後使用者什麼都沒收到
+reply_budget = ReplyBudget(
+    "reply",
+    float(os.getenv('REPLY_BUDGET', '8')),
+    lambda reply_token, messages: reply(line_bot_api, reply_token, messages),
+    lambda to, messages: push(line_bot_api, to, messages),
+    TextSendMessage(text="查詢中…")
+)
+
+def respond(event, produce):
+    reply_budget.respond(event.reply_token, push_target(event), produce, started_at=event.timestamp / 1000)
+
+# 每位使用者每秒補 USER_RATE_LIMIT 次查詢、最多連續 USER_RATE_BURST 次；各外部服務另有同時請求上限
+# 超過時不呼叫外部服務，有快取就回快取，沒有就請使用者稍後再試
+user_limiter = RateLimiter(
+    "user",
+    rate=float(os.getenv('USER_RATE_LIMIT', '0.2')),
+    burst=float(os.getenv('USER_RATE_BURST', '5')),
+    max_users=int(os.getenv('RATE_LIMIT_MAX_USERS', '10000'))
+)
+dependency_limits = {
+    "yfinance": ConcurrencyLimit("yfinance", int(os.getenv('YFINANCE_CONCURRENCY', '4'))),
+    "yahoo_news": ConcurrencyLimit("yahoo_news", int(os.getenv('NEWS_CONCURRENCY', '2'))),
+}
+
+def limited(dependency, cached=None):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(event, *args):
+            if not user_limiter.allow(event_key(event)):
+                busy = "查詢太頻繁，請稍後再試"
+            else:
+                with dependency_limits[dependency].acquire() as acquired:
+                    if acquired:
+                        return func(event, *args)
+                busy = "目前查詢的人較多，請稍後再試"
+            reply = cached(event, *args) if cached else None
+            return reply or TextSendMessage(text=busy)
+        return wrapper
+    return decorate
+
+@handler.add(MessageEvent, message=TextMessage)
+def handle_message(event):
+    respond(event, lambda: build_reply(event))
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
-    user_id = event.source.user_id
-    postback_data = event.postback.data
-
-    if postback_data.startswith("from_currency"):
-        currency = postback_data.split("=")[1]
-        user_states[user_id]["from_currency"] = currency
-        ask_currency(event.reply_token, "請選擇目標貨幣", "to_currency")
-    elif postback_data.startswith("to_currency"):
-        currency = postback_data.split("=")[1]
-        user_states[user_id]["to_currency"] = currency
-
-        if "amount" not in user_states[user_id]:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請輸入金額"))
-            return
-
-        amount = user_states[user_id]["amount"]
-        from_currency = user_states[user_id]["from_currency"]
-        to_currency = currency
-        
-        converted_amount, error = convert_currency(amount, from_currency, to_currency)
-        if error:
-            reply_text = error
-        else:
-            reply_text = f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
+    respond(event, lambda: build_reply(event))
 
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=reply_text)
-        )
-        # 重置狀態以便下次重新開始匯率轉換
-        user_states[user_id] = None
+def build_reply(event):
+    # 依事件內容交給 router 產生回覆訊息，不負責送出；asgi.py 的 asyncio 引擎也用這個函式
+    if isinstance(event, PostbackEvent):
+        return router.dispatch_postback(event, event.postback.data)
+    text = event.message.text.strip()
+    state = user_states.get(event.source.user_id, ConversationState())
+    return router.dispatch_message(event, text, state, state.step)
+
+def format_conversion(amount, from_currency, to_currency):
+    converted_amount, error = convert_currency(amount, from_currency, to_currency)
+    if error:
+        return error
+    return f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
 
-def send_financial_tip(reply_token):
+@router.command("理財小知識")
+def send_financial_tip(event, text, state):
     import random
     tip = random.choice(financial_tips)
     message = f"{tip['title']}\n{tip['content']}"
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text=message)
-    )
+    return TextSendMessage(text=message)
 
-def ask_currency(reply_token, text, prefix):
-    currencies = list(exchange_rates.keys())
-    actions = [QuickReplyButton(action=PostbackAction(label=currency, data=f"{prefix}={currency}")) for currency in currencies]
-    quick_reply = QuickReply(items=actions[:13])  # LINE quick reply 有 13 個按鈕限制
-    
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text=text, quick_reply=quick_reply)
-    )
+@router.command("匯率轉換")
+def start_currency_conversion(event, text, state):
+    user_states.set(event.source.user_id, ConversationState(step="currency_conversion_amount"))
+    return TextSendMessage(text="請輸入金額，例如：100\n想一次換算所有貨幣可輸入：100 USD 全部")
+
+@router.suffix("全部")
+def convert_to_all_currencies(event, text, state):
+    parts = text.split()
+    try:
+        amount = float(parts[0])
+    except ValueError:
+        amount = None
+    if len(parts) != 3 or amount is None:
+        return TextSendMessage(text="請輸入金額與貨幣，例如：100 USD 全部")
+
+    currency, results, error = convert_to_all(amount, parts[1])
+    if error:
+        return TextSendMessage(text=error)
+    lines = [f"{amount} {currency} 等於："]
+    lines += [f"{target}: {value:,.2f}" for target, value in results if target != currency]
+    return TextSendMessage(text="\n".join(lines))
+
+@router.state("currency_conversion_amount", NUMBER)
+def receive_amount(event, text, state):
+    user_states.set(event.source.user_id, ConversationState(amount=float(text)))
+    return ask_currency("請選擇來源貨幣", "from_currency")
+
+@router.state("currency_conversion_amount", TEXT)
+def reject_amount(event, text, state):
+    return TextSendMessage(text="請輸入正確的金額，例如：100")
+
+@router.state("currency_conversion_from")
+def receive_from_currency(event, text, state):
+    user_states.merge(event.source.user_id, from_currency=text)
+    return ask_currency("請選擇目標貨幣", "to_currency")
+
+@router.state("currency_conversion_to")
+def receive_to_currency(event, text, state):
+    user_id = event.source.user_id
+    state = user_states.merge(user_id, to_currency=text)
+    reply_text = format_conversion(state.amount, state.from_currency, text)
+    # 重置狀態以便下次重新開始匯率轉換
+    user_states.delete(user_id)
+    return TextSendMessage(text=reply_text)
 
-def show_main_menu(reply_token):
+def format_news(news_links):
+    news_message = "\n".join(news_links)
+    return TextSendMessage(text=f"最新的財經新聞：\n{news_message}")
+
+def cached_news(event, text, state):
+    if news_feed.links:
+        return format_news(news_feed.links)
+
+@router.command("財經新聞")
+@limited("yahoo_news", cached=cached_news)
+def send_financial_news(event, text, state):
+    news_links = get_financial_news()
+    if news_links:
+        return format_news(news_links)
+    return TextSendMessage(text="抱歉，無法獲取財經新聞。")
+
+@router.command("股票資訊")
+def ask_stock_ticker(event, text, state):
+    user_states.set(event.source.user_id, ConversationState(step="stock_info"))
+    return templates.get("ask_stock")
+
+def build_ask_stock():
+    return TextSendMessage(text="請輸入股票代碼，例如：AAPL\n多檔比較請用空白分隔，例如：AAPL MSFT GOOGL")
+
+def cached_stock_info(event, text, state):
+    tickers = parse_tickers(text)
+    info = quote_cache.peek(tickers[0]) if len(tickers) == 1 else None
+    if info is not None:
+        return TextSendMessage(text=format_stock_info(info))
+
+@router.state("stock_info")
+@limited("yfinance", cached=cached_stock_info)
+def send_stock_info(event, text, state):
+    tickers = parse_tickers(text)
+    if not tickers:
+        # 只輸入了逗號之類的符號，保留狀態請使用者重新輸入
+        return templates.get("ask_stock")
+    if len(tickers) > 1:
+        stock_info = get_stock_quotes(tickers)
+    else:
+        stock_info = get_stock_info(tickers[0])
+    # 重置狀態以便下次重新查詢股票資訊
+    user_states.delete(event.source.user_id)
+    return TextSendMessage(text=stock_info)
+
+@router.prefix("走勢圖")
+@limited("yfinance")
+def send_stock_chart(event, text, state):
+    parts = text.split()
+    ticker = parts[1].upper() if len(parts) > 1 else None
+    period = parts[2].lower() if len(parts) > 2 else "1y"
+    if ticker is None or period not in PERIODS:
+        return TextSendMessage(text=f"請輸入股票代碼與區間，例如：走勢圖 AAPL 1y\n可用區間：{', '.join(PERIODS)}")
+
+    try:
+        chart = get_chart(ticker, period)
+    except PoolBusy:
+        return TextSendMessage(text="目前使用的人較多，請稍後再試")
+    except TimeoutError:
+        return TextSendMessage(text="產生走勢圖逾時，請稍後再試")
+    except CircuitOpen:
+        return TextSendMessage(text=UPSTREAM_DOWN)
+    except Exception as e:
+        return TextSendMessage(text=f"無法產生走勢圖: {str(e)}")
+    if chart is None:
+        return TextSendMessage(text=f"查無 {ticker} 的股價資料")
+
+    urls = chart_urls(ticker, period, chart)
+    if urls is None:
+        return TextSendMessage(text="尚未設定 PUBLIC_BASE_URL，無法傳送圖片")
+    image_url, preview_url = urls
+    return ImageSendMessage(original_content_url=image_url, preview_image_url=preview_url)
+
+@router.fallback
+def show_main_menu(event, text, state):
+    return templates.get("main_menu")
+
+def build_main_menu():
     buttons_template = ButtonsTemplate(
         title='主選單',
         text='請選擇功能',
@@ -251,8 +647,84 @@ def show_main_menu(reply_token):
             MessageAction(label='股票資訊', text='股票資訊')
         ]
     )
-    message = TemplateSendMessage(alt_text='主選單', template=buttons_template)
-    line_bot_api.reply_message(reply_token, message)
+    return TemplateSendMessage(alt_text='主選單', template=buttons_template)
+
+@router.postback("from_currency")
+def choose_from_currency(event, currency):
+    user_states.merge(event.source.user_id, from_currency=currency)
+    return ask_currency("請選擇目標貨幣", "to_currency")
+
+@router.postback("to_currency")
+def choose_to_currency(event, currency):
+    user_id = event.source.user_id
+    state = user_states.merge(user_id, to_currency=currency)
+
+    if state.amount is None:
+        return TextSendMessage(text="請輸入金額")
+
+    reply_text = format_conversion(state.amount, state.from_currency, currency)
+    # 重置狀態以便下次重新開始匯率轉換
+    user_states.delete(user_id)
+    return TextSendMessage(text=reply_text)
+
+def ask_currency(text, prefix):
+    return templates.get("ask_currency", text, prefix)
+
+def build_ask_currency(text, prefix):
+    currencies = list(exchange_rates.keys())
+    actions = [QuickReplyButton(action=PostbackAction(label=currency, data=f"{prefix}={currency}")) for currency in currencies]
+    quick_reply = QuickReply(items=actions[:13])  # LINE quick reply 有 13 個按鈕限制
+    return TextSendMessage(text=text, quick_reply=quick_reply)
+
+# 固定的回覆在啟動時就建好；可選的貨幣改變時 ask_currency 會自動重建
+templates.register("main_menu", build_main_menu)
+templates.register("ask_stock", build_ask_stock)
+templates.register("ask_currency", build_ask_currency, version=lambda: tuple(exchange_rates))
+templates.get("main_menu")
+templates.get("ask_stock")
+templates.get("ask_currency", "請選擇來源貨幣", "from_currency")
+templates.get("ask_currency", "請選擇目標貨幣", "to_currency")
+
+metrics.register(
+    "linebot_webhook_seconds", "histogram", "Time spent handling /callback.", lambda: [({}, webhook_latency)]
+)
+metrics.register(
+    "linebot_webhook_events_total", "counter", "Events received on /callback.", lambda: [({}, webhook_events)]
+)
+metrics.register(
+    "linebot_command_seconds", "histogram", "Latency of each message and postback handler.",
+    lambda: [({"command": name}, histogram) for name, histogram in router.latency.items()]
+)
+metrics.register(
+    "linebot_cache_requests_total", "counter", "Cache lookups by result.",
+    lambda: [
+        ({"cache": cache.name, "result": result}, counter)
+        for cache in (quote_cache, batch_quote_cache, chart_cache)
+        for result, counter in (("hit", cache.hits), ("stale", cache.stale_hits), ("miss", cache.misses))
+    ]
+)
+metrics.register(
+    "linebot_cache_refresh_errors_total", "counter", "Failed background cache refreshes.",
+    lambda: [({"cache": cache.name}, cache.refresh_errors) for cache in (quote_cache, batch_quote_cache, chart_cache)]
+)
+metrics.register(
+    "linebot_replies_total", "counter", "Replies by delivery path.",
+    lambda: [
+        ({"path": "in_time"}, reply_budget.in_time),
+        ({"path": "late"}, reply_budget.late),
+        ({"path": "pushed"}, reply_budget.pushed),
+        ({"path": "push_failed"}, reply_budget.push_failed),
+    ]
+)
+metrics.register(
+    "linebot_duplicate_events_total", "counter", "Redelivered events that were dropped.",
+    lambda: [({}, deduper.duplicates)]
+)
+metrics.register(
+    "linebot_rate_limited_total", "counter", "Requests refused by a rate or concurrency limit.",
+    lambda: [({"limit": "user"}, user_limiter.limited)]
+    + [({"limit": name}, limit.rejected) for name, limit in dependency_limits.items()]
+)
 
 if __name__ == "__main__":
     app.run(debug=True)
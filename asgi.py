@@ -0,0 +1,260 @@
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot import AsyncLineBotApi
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage, PostbackEvent
+
+import app as bot
+import async_http
+import http_client
+import metrics
+from metrics import Counter
+from reply_templates import reply_async, push_async
+
+logger = logging.getLogger(__name__)
+
+# asyncio 版的 webhook 引擎：uvicorn asgi:app --workers 2
+# /callback 的驗章、LINE reply/push、Yahoo 新聞與匯率更新都在事件迴圈上用 aiohttp 進行，等待網路時不佔執行緒，
+# 同一個行程可以同時處理上千段對話；指令沿用 app.py 的 router 與 handler（bot.build_reply），在執行緒池裡執行
+# yfinance 沒有非同步 API，查股價仍在這些執行緒裡進行，並受 app.py 的 dependency_limits 限制
+# 其他路由（走勢圖、/api/convert、/stats、/metrics、/status）交給原本的 Flask app 處理
+
+HANDLER_THREADS = int(os.getenv('ASYNC_HANDLER_THREADS', '32'))
+# 同時處理中的事件上限，超過時回 503 讓 LINE 稍後重送，不記入 dedupe
+MAX_EVENTS = int(os.getenv('ASYNC_MAX_EVENTS', '5000'))
+SHUTDOWN_GRACE = float(os.getenv('ASYNC_SHUTDOWN_GRACE', '10'))
+
+executor = ThreadPoolExecutor(HANDLER_THREADS, thread_name_prefix="async-handler")
+line_bot_api = AsyncLineBotApi(
+    bot.line_channel_access_token,
+    async_http.SessionAsyncHttpClient(),
+    endpoint=http_client.LINE_API_ENDPOINT
+)
+
+events_handled = Counter()
+events_failed = Counter()
+events_rejected = Counter()
+_tasks = set()
+_refreshers = []
+# 同一位使用者的事件依收到的順序處理：每位使用者一把 asyncio.Lock，沒有事件等待時就移除
+_user_locks = {}
+_started = False
+_start_lock = asyncio.Lock()
+
+
+async def startup():
+    global _started
+    async with _start_lock:
+        if _started:
+            return
+        async_http.open_session()
+        # 新聞與匯率改由事件迴圈定期更新，不再開背景執行緒
+        for name, feed in (("news-feed", bot.news_feed), ("rates", bot.rate_provider)):
+            feed.stop_background()
+            _refreshers.append(asyncio.create_task(run_periodically(name, feed.interval, feed.refresh_async)))
+        if metrics.METRICS_DIR:
+            bot.metrics_flusher.start()
+        _started = True
+
+
+async def shutdown():
+    for task in _refreshers:
+        task.cancel()
+    # 讓處理中的事件把回覆送完
+    if _tasks:
+        await asyncio.wait(list(_tasks), timeout=SHUTDOWN_GRACE)
+    await async_http.close_session()
+    executor.shutdown(wait=False)
+
+
+async def run_periodically(name, interval, refresh):
+    while True:
+        try:
+            await refresh(async_http.get)
+        except Exception:
+            logger.exception("%s failed", name)
+        await asyncio.sleep(interval)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    # 不支援 lifespan 的 ASGI server 在第一個請求時啟動
+    if not _started:
+        await startup()
+    if scope["path"] == "/callback" and scope["method"] == "POST":
+        await callback(scope, receive, send)
+    else:
+        await call_wsgi(bot.app, scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_response(send, status, body, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def callback(scope, receive, send):
+    with bot.webhook_latency.time():
+        body = (await read_body(receive)).decode("utf-8")
+        signature = dict(scope["headers"]).get(b"x-line-signature", b"").decode("latin-1")
+        try:
+            events = bot.handler.parser.parse(body, signature)
+        except InvalidSignatureError:
+            await send_response(send, 400, b"Bad Request")
+            return
+
+        if len(_tasks) + len(events) > MAX_EVENTS:
+            events_rejected.inc(len(events))
+            await send_response(send, 503, b"busy", [(b"retry-after", b"1")])
+            return
+        bot.webhook_events.inc(len(events))
+        # DEDUPE_STORE=sqlite 時 filter 會等資料庫鎖，不能在事件迴圈上執行；
+        # 也不放進 handler 執行緒池，避免排在慢的 yfinance 查詢後面
+        for event in await asyncio.to_thread(bot.deduper.filter, events):
+            if isinstance(event, PostbackEvent) or (
+                isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)
+            ):
+                task = asyncio.create_task(in_order(bot.event_key(event), event))
+                _tasks.add(task)
+                task.add_done_callback(_tasks.discard)
+    await send_response(send, 200, b"OK")
+
+
+async def in_order(key, event):
+    entry = _user_locks.get(key)
+    if entry is None:
+        entry = _user_locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await handle_event(event)
+        events_handled.inc()
+    except Exception:
+        events_failed.inc()
+        logger.exception("failed to handle event")
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _user_locks[key]
+
+
+async def handle_event(event):
+    # 與 app.py 的 ReplyBudget 相同：期限內完成就 reply，來不及先回 placeholder，做完再 push
+    budget = bot.reply_budget
+    remaining = budget.budget - (time.time() - event.timestamp / 1000)
+    work = asyncio.get_running_loop().run_in_executor(executor, bot.build_reply, event)
+    try:
+        messages = await asyncio.wait_for(asyncio.shield(work), max(remaining, 0))
+    except asyncio.TimeoutError:
+        budget.late.inc()
+        # placeholder 送不出去（reply token 過期或已用過）時照樣把結果 push 出去
+        try:
+            await reply_async(line_bot_api, event.reply_token, budget.placeholder)
+        except Exception:
+            logger.exception("placeholder reply failed")
+        messages = await work
+        to = bot.push_target(event)
+        if not messages or to is None:
+            return
+        try:
+            await push_async(line_bot_api, to, messages)
+            budget.pushed.inc()
+        except Exception:
+            budget.push_failed.inc()
+            raise
+        return
+    if messages:
+        budget.in_time.inc()
+        await reply_async(line_bot_api, event.reply_token, messages)
+
+
+async def call_wsgi(wsgi_app, scope, receive, send):
+    # 最小的 WSGI 轉接：在執行緒池呼叫 Flask app，整個回應讀進記憶體後送出
+    body = await read_body(receive)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": (scope.get("server") or ("localhost", 80))[0],
+        "SERVER_PORT": str((scope.get("server") or ("localhost", 80))[1]),
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+    def run():
+        result = wsgi_app(environ, start_response)
+        try:
+            return b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    content = await asyncio.get_running_loop().run_in_executor(executor, run)
+    await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+    await send({"type": "http.response.body", "body": content})
+
+
+metrics.register(
+    "linebot_async_events_total", "counter", "Events handled by the asyncio engine by result.",
+    lambda: [
+        ({"result": "handled"}, events_handled),
+        ({"result": "failed"}, events_failed),
+        ({"result": "rejected"}, events_rejected),
+    ]
+)
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+import requests
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient, AiohttpAsyncHttpResponse
+
+import http_client
+
+# asyncio 模式（asgi.py）共用的 aiohttp 連線池，設定沿用 http_client 的逾時與連線數
+# 錯誤一律轉成 requests 的例外，NewsFeed、RateProvider 等呼叫端沿用同一套錯誤處理
+
+# 非同步連線不佔執行緒，每個 host 可以開得比同步模式的 HTTP_POOL_SIZE 多
+POOL_SIZE = int(os.getenv('ASYNC_HTTP_POOL_SIZE', '100'))
+
+_session = None
+
+
+def open_session():
+    global _session
+    # 每個 host 最多 ASYNC_HTTP_POOL_SIZE 條 keep-alive 連線，總數為 HTTP_POOL_HOSTS 倍
+    connector = aiohttp.TCPConnector(
+        limit=http_client.POOL_HOSTS * POOL_SIZE,
+        limit_per_host=POOL_SIZE,
+        ttl_dns_cache=300,
+    )
+    _session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=_timeout(http_client.DEFAULT_TIMEOUT),
+        headers={
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent': 'Mozilla/5.0 (compatible; linebot-openai)',
+        },
+    )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def get_session():
+    if _session is None:
+        raise RuntimeError("async HTTP session is not open")
+    return _session
+
+
+def _timeout(timeout):
+    # requests 的 (connect, read) 格式轉成 aiohttp 的 ClientTimeout
+    if isinstance(timeout, aiohttp.ClientTimeout):
+        return timeout
+    if isinstance(timeout, (tuple, list)):
+        return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+class Response:
+    # 已讀完內容的回應，欄位與 requests.Response 相同，可以直接交給原本的解析程式
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code} for {self.url}", response=self)
+
+
+async def get(url, headers=None, timeout=None):
+    try:
+        async with get_session().get(url, headers=headers, timeout=_timeout(timeout or http_client.DEFAULT_TIMEOUT)) as response:
+            content = await response.read()
+            return Response(url, response.status, response.headers, content)
+    except asyncio.TimeoutError as e:
+        raise requests.Timeout(str(e) or f"timed out fetching {url}")
+    except aiohttp.ClientError as e:
+        raise requests.ConnectionError(str(e))
+
+
+# 讓 AsyncLineBotApi 也走共用的連線池；先讀完內容再回傳，連線馬上放回池裡
+class SessionAsyncHttpClient(AiohttpAsyncHttpClient):
+    def __init__(self, timeout=http_client.DEFAULT_TIMEOUT):
+        super().__init__(None, timeout=timeout)
+
+    async def get(self, url, headers=None, params=None, timeout=None):
+        response = await get_session().get(
+            url, headers=headers, params=params, timeout=_timeout(timeout or self.timeout)
+        )
+        await response.read()
+        return AiohttpAsyncHttpResponse(response)
+
+    async def post(self, url, headers=None, data=None, timeout=None):
+        response = await get_session().post(url, headers=headers, data=data, timeout=_timeout(timeout or self.timeout))
+        await response.read()
+        return AiohttpAsyncHttpResponse(response)
+
+    async def delete(self, url, headers=None, data=None, timeout=None):
+        response = await get_session().delete(url, headers=headers, data=data, timeout=_timeout(timeout or self.timeout))
+        await response.read()
+        return AiohttpAsyncHttpResponse(response)
+
+    async def put(self, url, headers=None, data=None, timeout=None):
+        response = await get_session().put(url, headers=headers, data=data, timeout=_timeout(timeout or self.timeout))
+        await response.read()
+        return AiohttpAsyncHttpResponse(response)
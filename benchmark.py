@@ -0,0 +1,310 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+
+# 專案內的 copy.py 會蓋掉標準函式庫的 copy，專案目錄要放在 sys.path 最後面
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or '.') != ROOT] + [ROOT]
+
+import requests  # noqa: E402
+
+# 離線壓測 /callback：不連 LINE 與 Yahoo，用假的 LineBotApi、yfinance 與 requests 模擬延遲
+# 每個情境用有簽章的 webhook 內容跑完整對話，回報 req/s、延遲分位數與記憶體
+# 用法：python benchmark.py [--module app] [--scenarios menu,currency] [--requests 500] [--concurrency 8]
+
+CHANNEL_SECRET = 'benchmark-secret'
+
+SCENARIOS = {
+    "menu": ["hi"],
+    "currency": ["匯率轉換", "100", ("postback", "from_currency=USD美金"), ("postback", "to_currency=TWD台幣")],
+    "convert_all": ["100 USD 全部"],
+    "stock": ["股票資訊", "{ticker}"],
+    "batch": ["股票資訊", "{ticker} {ticker2} {ticker3}"],
+    "news": ["財經新聞"],
+    "quiz": ["理財測驗", "第1題", "D"],
+}
+# 一般使用情況的比例，mixed 情境依此抽樣
+MIX = {"menu": 30, "currency": 25, "convert_all": 5, "stock": 25, "batch": 5, "news": 10}
+TICKERS = ["AAPL", "MSFT", "GOOGL", "AMZN", "META", "NVDA", "TSLA", "TSM", "2330.TW", "0050.TW"]
+
+NEWS_HTML = "<html><body>" + "".join(
+    f'<a href="https://finance.yahoo.com/news/market-story-{i}.html">Stock market story {i}</a>' for i in range(40)
+) + "</body></html>"
+RATES_JSON = {"result": "success", "rates": {"USD": 1, "TWD": 32.1, "EUR": 0.91, "JPY": 149.5, "CNY": 7.2}}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8", "replace")
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}", response=self)
+
+    def iter_content(self, chunk_size=1024):
+        yield self.content
+
+
+class FakeSession:
+    # 取代 http_client 的共用 Session：LINE API、Yahoo 新聞與匯率來源都回固定內容
+    # 有 line_endpoint 時 LINE API 的請求改用真的 Session 送到本機的假 LINE API，連序列化與連線成本一起量
+    def __init__(self, http_latency, line_latency, line_endpoint=None):
+        self.http_latency = http_latency
+        self.line_latency = line_latency
+        self.line_endpoint = line_endpoint
+        self.real = requests.Session() if line_endpoint else None
+        self.line_calls = 0
+        self.upstream_calls = 0
+
+    def _respond(self, method, url, kwargs):
+        if self.line_endpoint and url.startswith(self.line_endpoint):
+            self.line_calls += 1
+            return self.real.request(method, url, **kwargs)
+        if "api.line.me" in url or "api-data.line.me" in url:
+            self.line_calls += 1
+            time.sleep(self.line_latency)
+            return FakeResponse(200, b"{}", {"x-line-request-id": "benchmark"})
+        self.upstream_calls += 1
+        time.sleep(self.http_latency)
+        if "er-api" in url or "rates" in url.lower():
+            return FakeResponse(200, json.dumps(RATES_JSON).encode())
+        return FakeResponse(200, NEWS_HTML.encode(), {"ETag": '"benchmark"'})
+
+    def get(self, url, **kwargs):
+        return self._respond("GET", url, kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond("POST", url, kwargs)
+
+    def put(self, url, **kwargs):
+        return self._respond("PUT", url, kwargs)
+
+    def delete(self, url, **kwargs):
+        return self._respond("DELETE", url, kwargs)
+
+
+def fake_yfinance(latency):
+    # 只實作 bot 用到的 Ticker().info、Ticker().history 與 download
+    module = types.ModuleType("yfinance")
+
+    class Ticker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        @property
+        def info(self):
+            time.sleep(latency)
+            return {
+                "longName": f"{self.ticker} Inc.", "currentPrice": 123.45, "marketCap": 1_000_000_000,
+                "industry": "Technology", "fiftyTwoWeekHigh": 150.0, "fiftyTwoWeekLow": 90.0,
+                "trailingPE": 25.3, "dividendYield": 0.01, "market": "us_market",
+            }
+
+        def history(self, period="1y"):
+            import numpy as np
+            import pandas as pd
+            time.sleep(latency)
+            index = pd.date_range(end=pd.Timestamp.today(), periods=250)
+            return pd.DataFrame({"Close": np.linspace(100, 120, len(index))}, index=index)
+
+    def download(tickers, **kwargs):
+        import numpy as np
+        import pandas as pd
+        time.sleep(latency)
+        index = pd.date_range(end=pd.Timestamp.today(), periods=5)
+        columns = pd.MultiIndex.from_product([tickers, ["Close", "Volume"]])
+        return pd.DataFrame(np.tile([100.0, 1e6], (len(index), len(tickers))), index=index, columns=columns)
+
+    module.Ticker = Ticker
+    module.download = download
+    return module
+
+
+def load_app(module_name, http_latency, line_latency, yf_latency, line_endpoint=None):
+    if line_endpoint:
+        os.environ['LINE_API_ENDPOINT'] = line_endpoint
+    os.environ.setdefault('CHANNEL_ACCESS_TOKEN', 'benchmark-token')
+    os.environ['CHANNEL_SECRET'] = CHANNEL_SECRET
+    os.environ.pop('WARM_UP', None)
+    os.environ.pop('METRICS_DIR', None)
+    sys.modules['yfinance'] = fake_yfinance(yf_latency)
+
+    import http_client
+    session = FakeSession(http_latency, line_latency, line_endpoint)
+    http_client.get_session = lambda: session
+
+    path = os.path.join(ROOT, f"{module_name}.py")
+    spec = importlib.util.spec_from_file_location(f"benchmark_{module_name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module, session
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def make_event(step, user_id):
+    base = {
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex,
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+    }
+    if isinstance(step, tuple):
+        return dict(base, type="postback", postback={"data": step[1]})
+    tickers = random.sample(TICKERS, 3)
+    text = step.format(ticker=tickers[0], ticker2=tickers[1], ticker3=tickers[2])
+    return dict(base, type="message", message={"id": uuid.uuid4().hex[:12], "type": "text", "text": text})
+
+
+def make_body(step, user_id):
+    body = json.dumps({"destination": "benchmark", "events": [make_event(step, user_id)]}, ensure_ascii=False)
+    return body, sign(body)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(app, session, name, total_requests, concurrency):
+    # 每位模擬使用者依序送完整段對話；不同使用者在多個執行緒同時進行
+    client = app.test_client()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def conversation():
+        if name == "mixed":
+            return SCENARIOS[random.choices(list(MIX), weights=list(MIX.values()))[0]]
+        return SCENARIOS[name]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                steps = conversation()
+                remaining[0] -= len(steps)
+            user_id = "U" + uuid.uuid4().hex
+            for step in steps:
+                body, signature = make_body(step, user_id)
+                started = time.perf_counter()
+                response = client.post(
+                    "/callback", data=body.encode("utf-8"),
+                    headers={"X-Line-Signature": signature, "Content-Type": "application/json"}
+                )
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+    rss_before = rss_mb()
+    line_before, upstream_before = session.line_calls, session.upstream_calls
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"bench-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "req_per_sec": len(latencies) / duration if duration else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "line_calls": session.line_calls - line_before,
+        "upstream_calls": session.upstream_calls - upstream_before,
+        "rss_mb": rss_mb(),
+        "rss_delta_mb": rss_mb() - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline /callback benchmark")
+    parser.add_argument('--module', default='app', help="bot module to load, e.g. app or 11")
+    parser.add_argument('--scenarios', default=None, help=f"comma separated, from {', '.join(list(SCENARIOS) + ['mixed'])}")
+    parser.add_argument('--requests', type=int, default=300, help="webhook requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--line-latency', type=float, default=0.03, help="seconds per LINE API call")
+    parser.add_argument('--yf-latency', type=float, default=0.2, help="seconds per yfinance call")
+    parser.add_argument('--http-latency', type=float, default=0.1, help="seconds per Yahoo news / rate feed request")
+    parser.add_argument('--line-server', action='store_true',
+                        help="send LINE API calls over HTTP to an in-process fake_line_api server")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as JSON lines")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    line_server = None
+    line_endpoint = None
+    if args.line_server:
+        from fake_line_api import FakeLineApi
+        line_server = FakeLineApi(latency=args.line_latency, seed=args.seed)
+        line_endpoint = line_server.start()
+    app_module, session = load_app(args.module, args.http_latency, args.line_latency, args.yf_latency, line_endpoint)
+    if args.scenarios:
+        names = args.scenarios.split(',')
+    else:
+        names = [name for name in SCENARIOS if name != "quiz" or hasattr(app_module, "questions")] + ["mixed"]
+
+    if not args.json:
+        print(f"{'scenario':<12} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+              f"{'p99 ms':>8} {'max ms':>8} {'LINE':>5} {'http':>5} {'rss MB':>8} {'ΔMB':>6}")
+    for name in names:
+        result = run_scenario(app_module.app, session, name, args.requests, args.concurrency)
+        if args.json:
+            print(json.dumps(result))
+            continue
+        print(f"{name:<12} {result['requests']:>6} {result['errors']:>4} {result['req_per_sec']:>8.1f} "
+              f"{result['p50_ms']:>8.1f} {result['p90_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['max_ms']:>8.1f} {result['line_calls']:>5} {result['upstream_calls']:>5} {result['rss_mb']:>8.1f} {result['rss_delta_mb']:>6.1f}")
+
+    if line_server is not None:
+        rejected = [call for call in line_server.calls if call["status"] != 200]
+        print(f"fake LINE API: {len(line_server.calls)} calls, {len(rejected)} rejected")
+        for call in rejected[:5]:
+            print(f"  {call['kind']} {call['status']}: {json.dumps(call['body'], ensure_ascii=False)[:200]}")
+        line_server.stop()
+
+
+if __name__ == '__main__':
+    main()
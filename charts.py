@@ -0,0 +1,66 @@
+import hashlib
+import io
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# 股價走勢圖：用 matplotlib 的 Agg 後端在伺服器端繪製，不需要顯示器
+# 同一次繪圖輸出原圖與 LINE 需要的預覽圖，兩張圖共用同一份資料與版面
+
+PERIODS = ("1mo", "3mo", "6mo", "1y", "2y", "5y", "ytd", "max")
+FIGURE_SIZE = (10.24, 6.4)
+IMAGE_DPI = int(os.getenv('CHART_DPI', '100'))  # 1024 x 640
+PREVIEW_DPI = 23  # 約 235 x 147，LINE 預覽圖越小越快顯示
+MARKET_TZ = ZoneInfo(os.getenv('CHART_MARKET_TZ', 'America/New_York'))
+
+Chart = namedtuple("Chart", "image preview etag")
+
+
+def trading_day(now=None):
+    # 以交易所當地日期為準，週末沿用週五的圖
+    day = (now or datetime.now(MARKET_TZ)).date()
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day.isoformat()
+
+
+def parse_day(day):
+    # 只接受 YYYY-MM-DD 且不晚於目前交易日的日期，其他回傳 None
+    try:
+        parsed = date.fromisoformat(day)
+    except ValueError:
+        return None
+    if parsed.isoformat() != day or day > trading_day():
+        return None
+    return parsed
+
+
+def render_chart(ticker, period, day=None):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    import yfinance as yf
+
+    history = yf.Ticker(ticker).history(period=period)
+    # 過去交易日的圖片網址（已經傳進聊天室的舊訊息）只畫到那一天為止
+    if day is not None and day < trading_day():
+        history = history[history.index.date <= date.fromisoformat(day)]
+    if history.empty:
+        return None
+
+    # 直接建立 Figure 而不經過 pyplot，多執行緒同時繪圖也不會共用全域狀態
+    figure = Figure(figsize=FIGURE_SIZE)
+    ax = figure.subplots()
+    ax.plot(history.index, history["Close"], color="#1f77b4", linewidth=1.5)
+    ax.fill_between(history.index, history["Close"], history["Close"].min(), color="#1f77b4", alpha=0.1)
+    ax.set_title(f"{ticker} ({period})")
+    ax.grid(alpha=0.3)
+    figure.autofmt_xdate()
+
+    image = io.BytesIO()
+    figure.savefig(image, format="png", dpi=IMAGE_DPI)
+    preview = io.BytesIO()
+    figure.savefig(preview, format="png", dpi=PREVIEW_DPI)
+    image = image.getvalue()
+    return Chart(image, preview.getvalue(), hashlib.sha1(image).hexdigest())
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+# 量測 `import app` 的啟動時間，超過預算或提早載入重量級套件就回傳非 0
+# 用法：python check_import_time.py [模組名稱]
+
+BUDGET_MS = float(os.getenv('IMPORT_BUDGET_MS', '800'))
+HEAVY_MODULES = ['yfinance', 'pandas', 'numpy', 'bs4', 'matplotlib']
+
+
+def measure(module):
+    env = dict(os.environ)
+    env.setdefault('CHANNEL_ACCESS_TOKEN', 'dummy')
+    env.setdefault('CHANNEL_SECRET', 'dummy')
+    env.pop('WARM_UP', None)
+    # 專案內的 copy.py 會蓋掉標準函式庫的 copy，把專案目錄移到 sys.path 最後面
+    code = f'import sys; sys.path.append(sys.path.pop(0)); import {module}'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(result.returncode)
+
+    # 每行格式為 "import time: self [us] | cumulative | imported package"
+    # 套件名稱前的縮排代表巢狀層級，一個空白為最上層，每深一層多兩個空白
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        timings[name.strip()] = (int(cumulative) / 1000, depth)
+    return timings
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else 'app'
+    timings = measure(module)
+    total = timings.get(module, (0.0, 1))[0]
+    direct = {name: ms for name, (ms, depth) in timings.items() if depth == 3}
+
+    print(f"import {module}: {total:.1f} ms (budget {BUDGET_MS:.0f} ms)")
+    for name, ms in sorted(direct.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    loaded_heavy = [name for name in HEAVY_MODULES if name in timings]
+    if loaded_heavy:
+        print(f"heavy modules imported at startup: {', '.join(loaded_heavy)}")
+    if total > BUDGET_MS or loaded_heavy:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+
+from metrics import Counter
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+# 外部服務的斷路器：最近 window 次呼叫中失敗（含超過 slow_call 秒的慢呼叫）比例達到 error_rate 就跳開，
+# 跳開期間直接丟出 CircuitOpen，不再等待逾時；reset_timeout 秒後只放一個請求試探，成功才恢復
+class CircuitBreaker:
+    def __init__(self, name, window=20, min_calls=5, error_rate=0.5, slow_call=5.0, reset_timeout=30, ignore=()):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        # 這些例外不是外部服務的問題（例如本機工作池滿了），不計入失敗
+        self.ignore = tuple(ignore)
+        self.state = CLOSED
+        self.opened_at = None
+        self._results = deque(maxlen=window)
+        self._probing = False
+        # 每次跳開或恢復都換一代；跳開前就送出的慢呼叫回來時已是舊的一代，結果不再計入
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.failures = Counter()
+        self.slow_calls = Counter()
+        self.rejected = Counter()
+        self.trips = Counter()
+
+    def _allow(self):
+        # 允許呼叫時回傳目前的世代，否則回傳 None
+        with self._lock:
+            if self.state == CLOSED:
+                return self._generation
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return self._generation
+            return None
+
+    def _record(self, ok, generation):
+        with self._lock:
+            if generation != self._generation or self.state == OPEN:
+                return
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self.state = CLOSED
+                    self._generation += 1
+                    self._results.clear()
+                else:
+                    self._trip()
+                return
+            self._results.append(ok)
+            failed = self._results.count(False)
+            if len(self._results) >= self.min_calls and failed / len(self._results) >= self.error_rate:
+                self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._generation += 1
+        self._results.clear()
+        self.trips.inc()
+
+    def call(self, func, *args, **kwargs):
+        generation = self._enter()
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except self.ignore:
+            self._release_probe(generation)
+            raise
+        except Exception:
+            self._failed(generation)
+            raise
+        self._succeeded(started, generation)
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        # 與 call() 相同，給 asyncio 模式的 coroutine 使用
+        generation = self._enter()
+        started = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except self.ignore:
+            self._release_probe(generation)
+            raise
+        except Exception:
+            self._failed(generation)
+            raise
+        self._succeeded(started, generation)
+        return result
+
+    def _enter(self):
+        generation = self._allow()
+        if generation is None:
+            self.rejected.inc()
+            raise CircuitOpen(f"{self.name} circuit is open")
+        self.calls.inc()
+        return generation
+
+    def _release_probe(self, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._probing = False
+
+    def _failed(self, generation):
+        self.failures.inc()
+        self._record(False, generation)
+
+    def _succeeded(self, started, generation):
+        slow = time.monotonic() - started > self.slow_call
+        if slow:
+            self.slow_calls.inc()
+        self._record(not slow, generation)
+
+    def stats(self):
+        with self._lock:
+            results = list(self._results)
+            state = self.state
+            opened_at = self.opened_at
+        return {
+            "state": state,
+            "recent_error_rate": round(results.count(False) / len(results), 3) if results else 0.0,
+            "open_for": round(time.monotonic() - opened_at, 1) if state != CLOSED and opened_at else None,
+            "calls": self.calls.value,
+            "failures": self.failures.value,
+            "slow_calls": self.slow_calls.value,
+            "rejected": self.rejected.value,
+            "trips": self.trips.value,
+        }
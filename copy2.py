@@ -1,4 +1,5 @@
 import os
+from collections import namedtuple
 from flask import Flask, request, abort
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
@@ -6,8 +7,10 @@ from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, PostbackEvent, PostbackAction,
     QuickReply, QuickReplyButton, MessageAction, ButtonsTemplate, TemplateSendMessage
 )
-import requests
-from bs4 import BeautifulSoup
+import http_client
+from session_store import create_store
+from router import Router, TEXT, NUMBER
+from reply_templates import ReplyTemplates, reply
 
 app = Flask(__name__)
 
@@ -15,7 +18,7 @@ app = Flask(__name__)
 line_channel_access_token = os.getenv('CHANNEL_ACCESS_TOKEN')
 line_channel_secret = os.getenv('CHANNEL_SECRET')
 
-line_bot_api = LineBotApi(line_channel_access_token)
+line_bot_api = LineBotApi(line_channel_access_token, endpoint=http_client.LINE_API_ENDPOINT, timeout=http_client.DEFAULT_TIMEOUT, http_client=http_client.SessionHttpClient)
 handler = WebhookHandler(line_channel_secret)
 
 # 理財測驗題目和答案
@@ -32,9 +35,13 @@ questions = [
     {"question": "10. 什麼是財務報表中的資產負債表？", "options": ["A) 顯示公司的收益和支出", "B) 顯示公司的現金流量", "C) 顯示公司的財務狀況", "D) 顯示公司的所有者權益"], "answer": "C"},
 ]
 
-# 用戶回答情況記錄
-user_scores = {}
-user_states = {}
+# 測驗進度與匯率轉換中的資料，以 namedtuple 取代 dict 節省記憶體
+UserScore = namedtuple(
+    "UserScore", "score current_question amount from_currency to_currency", defaults=(None, None, None, None, None)
+)
+# 用戶回答情況記錄，SESSION_STORE 設為 sqlite 時可在多個 worker 之間共用
+user_scores = create_store("user_scores", record=UserScore)
+user_states = create_store("user_states")
 
 # 固定匯率數據
 exchange_rates = {
@@ -66,10 +73,11 @@ def get_financial_news():
     url = 'https://finance.yahoo.com/'
     financial_keywords = ['finance', 'financial', 'market', 'stock', 'economy', 'investment', 'money', 'business']
 
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code != 200:
         return None
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(response.content, 'html.parser')
     links = soup.find_all('a')
 
@@ -97,156 +105,162 @@ def callback():
 
     return 'OK'
 
+router = Router()
+templates = ReplyTemplates()
+
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     user_id = event.source.user_id
     text = event.message.text.strip()
+    state = user_states.get(user_id)
 
-    if text == "理財測驗":
-        user_scores[user_id] = {"score": 0, "current_question": 0}
-        user_states[user_id] = "quiz"
-        send_question(event.reply_token, user_id)
-    elif text == "匯率轉換":
-        user_states[user_id] = "currency_conversion_amount"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="請輸入金額，例如：100")
-        )
-    elif user_states.get(user_id) == "currency_conversion_amount":
-        try:
-            amount = float(text)
-            user_scores[user_id] = {"amount": amount}
-            user_states[user_id] = "currency_conversion_from"
-            ask_currency(event.reply_token, "請選擇來源貨幣", "from_currency")
-        except ValueError:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="請輸入正確的金額，例如：100")
-            )
-    elif user_states.get(user_id) == "currency_conversion_from":
-        user_scores[user_id]["from_currency"] = text
-        user_states[user_id] = "currency_conversion_to"
-        ask_currency(event.reply_token, "請選擇目標貨幣", "to_currency")
-    elif user_states.get(user_id) == "currency_conversion_to":
-        user_scores[user_id]["to_currency"] = text
-        amount = user_scores[user_id]["amount"]
-        from_currency = user_scores[user_id]["from_currency"]
-        to_currency = text
-        
-        converted_amount, error = convert_currency(amount, from_currency, to_currency)
-        if error:
-            reply_text = error
-        else:
-            reply_text = f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
-
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=reply_text)
-        )
-        # 重置狀態以便下次重新開始匯率轉換
-        user_states[user_id] = None
-        user_scores[user_id] = {}
-    elif text == "財經新聞":
-        news_links = get_financial_news()
-        if news_links:
-            news_message = "\n".join(news_links)
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=f"最新的財經新聞：\n{news_message}")
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="抱歉，無法獲取財經新聞。")
-            )
-    else:
-        show_main_menu(event.reply_token)
+    messages = router.dispatch_message(event, text, state, state)
+    if messages:
+        reply(line_bot_api, event.reply_token, messages)
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
+    messages = router.dispatch_postback(event, event.postback.data)
+    if messages:
+        reply(line_bot_api, event.reply_token, messages)
+
+def format_conversion(amount, from_currency, to_currency):
+    converted_amount, error = convert_currency(amount, from_currency, to_currency)
+    if error:
+        return error
+    return f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
+
+@router.command("理財測驗")
+def start_quiz(event, text, state):
     user_id = event.source.user_id
-    postback_data = event.postback.data
-
-    if postback_data.startswith("from_currency"):
-        currency = postback_data.split("=")[1]
-        user_scores[user_id]["from_currency"] = currency
-        user_states[user_id] = "currency_conversion_to"
-        ask_currency(event.reply_token, "請選擇目標貨幣", "to_currency")
-    elif postback_data.startswith("to_currency"):
-        currency = postback_data.split("=")[1]
-        user_scores[user_id]["to_currency"] = currency
-        amount = user_scores[user_id]["amount"]
-        from_currency = user_scores[user_id]["from_currency"]
-        to_currency = currency
-        
-        converted_amount, error = convert_currency(amount, from_currency, to_currency)
-        if error:
-            reply_text = error
-        else:
-            reply_text = f"{amount} {from_currency} is equal to {converted_amount:.2f} {to_currency}"
-
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=reply_text)
-        )
-        # 重置狀態以便下次重新開始匯率轉換
-        user_states[user_id] = None
-        user_scores[user_id] = {}
-
-    elif user_id not in user_scores:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請輸入 '理財測驗' 來開始測驗。"))
-        return
-
-    question_index = user_scores[user_id]["current_question"]
+    user_scores.set(user_id, UserScore(score=0, current_question=0))
+    user_states.set(user_id, "quiz")
+    return send_question(0)
+
+@router.command("匯率轉換")
+def start_currency_conversion(event, text, state):
+    user_states.set(event.source.user_id, "currency_conversion_amount")
+    return TextSendMessage(text="請輸入金額，例如：100")
+
+@router.state("currency_conversion_amount", NUMBER)
+def receive_amount(event, text, state):
+    user_id = event.source.user_id
+    user_scores.set(user_id, UserScore(amount=float(text)))
+    user_states.set(user_id, "currency_conversion_from")
+    return ask_currency("請選擇來源貨幣", "from_currency")
+
+@router.state("currency_conversion_amount", TEXT)
+def reject_amount(event, text, state):
+    return TextSendMessage(text="請輸入正確的金額，例如：100")
+
+@router.state("currency_conversion_from")
+def receive_from_currency(event, text, state):
+    user_id = event.source.user_id
+    user_scores.merge(user_id, from_currency=text)
+    user_states.set(user_id, "currency_conversion_to")
+    return ask_currency("請選擇目標貨幣", "to_currency")
+
+@router.state("currency_conversion_to")
+def receive_to_currency(event, text, state):
+    user_id = event.source.user_id
+    conversion = user_scores.merge(user_id, to_currency=text)
+    reply_text = format_conversion(conversion.amount, conversion.from_currency, text)
+    # 重置狀態以便下次重新開始匯率轉換
+    user_states.delete(user_id)
+    user_scores.delete(user_id)
+    return TextSendMessage(text=reply_text)
+
+@router.command("財經新聞")
+def send_financial_news(event, text, state):
+    news_links = get_financial_news()
+    if news_links:
+        news_message = "\n".join(news_links)
+        return TextSendMessage(text=f"最新的財經新聞：\n{news_message}")
+    return TextSendMessage(text="抱歉，無法獲取財經新聞。")
+
+@router.fallback
+def show_main_menu(event, text, state):
+    return templates.get("main_menu")
+
+def build_main_menu():
+    buttons_template = ButtonsTemplate(
+        title='主選單',
+        text='請選擇功能',
+        actions=[
+            MessageAction(label='理財測驗', text='理財測驗'),
+            MessageAction(label='匯率轉換', text='匯率轉換'),
+            MessageAction(label='財經新聞', text='財經新聞')
+        ]
+    )
+    return TemplateSendMessage(alt_text='主選單', template=buttons_template)
+
+@router.postback("from_currency")
+def choose_from_currency(event, currency):
+    user_id = event.source.user_id
+    user_scores.merge(user_id, from_currency=currency)
+    user_states.set(user_id, "currency_conversion_to")
+    return ask_currency("請選擇目標貨幣", "to_currency")
+
+@router.postback("to_currency")
+def choose_to_currency(event, currency):
+    user_id = event.source.user_id
+    conversion = user_scores.merge(user_id, to_currency=currency)
+    reply_text = format_conversion(conversion.amount, conversion.from_currency, currency)
+    # 重置狀態以便下次重新開始匯率轉換
+    user_states.delete(user_id)
+    user_scores.delete(user_id)
+    return TextSendMessage(text=reply_text)
+
+@router.postback_fallback
+def score_answer(event, postback_data):
+    user_id = event.source.user_id
+    if user_scores.get(user_id) is None:
+        return TextSendMessage(text="請輸入 '理財測驗' 來開始測驗。")
+
+    # 計分與前進到下一題在同一次原子讀改寫內完成
+    scores = user_scores.update(user_id, lambda scores: scores._replace(
+        score=scores.score + (postback_data == questions[scores.current_question]["answer"]),
+        current_question=scores.current_question + 1
+    ))
+    question_index = scores.current_question - 1
     if postback_data == questions[question_index]["answer"]:
-        user_scores[user_id]["score"] += 1
         response_text = "答對了！"
     else:
         response_text = f"答錯了，正確答案是：{questions[question_index]['answer']}"
 
-    user_scores[user_id]["current_question"] += 1
-    if user_scores[user_id]["current_question"] < len(questions):
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-        send_question(event.reply_token, user_id)
-    else:
-        final_score = user_scores[user_id]["score"]
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"{response_text}\n測驗結束！你總共答對了 {final_score} 題。"))
+    if scores.current_question < len(questions):
+        return [TextSendMessage(text=response_text), send_question(scores.current_question)]
+    final_score = scores.score
+    return TextSendMessage(text=f"{response_text}\n測驗結束！你總共答對了 {final_score} 題。")
+
+def send_question(question_index):
+    return templates.get("question", question_index)
 
-def send_question(reply_token, user_id):
-    question_index = user_scores[user_id]["current_question"]
+def build_question(question_index):
     question = questions[question_index]["question"]
     options = questions[question_index]["options"]
 
     actions = [QuickReplyButton(action=PostbackAction(label=option, data=option[0])) for option in options]
     quick_reply = QuickReply(items=actions[:4])  # LINE quick reply 的按鈕限制
+    return TextSendMessage(text=question, quick_reply=quick_reply)
 
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text=question, quick_reply=quick_reply)
-    )
+def ask_currency(text, prefix):
+    return templates.get("ask_currency", text, prefix)
 
-def ask_currency(reply_token, text, prefix):
+def build_ask_currency(text, prefix):
     currencies = list(exchange_rates.keys())
     actions = [QuickReplyButton(action=PostbackAction(label=currency, data=f"{prefix}={currency}")) for currency in currencies]
     quick_reply = QuickReply(items=actions[:13])  # LINE quick reply 有 13 個按鈕限制
-    
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text=text, quick_reply=quick_reply)
-    )
+    return TextSendMessage(text=text, quick_reply=quick_reply)
 
-def show_main_menu(reply_token):
-    buttons_template = ButtonsTemplate(
-        title='主選單',
-        text='請選擇功能',
-        actions=[
-            MessageAction(label='理財測驗', text='理財測驗'),
-            MessageAction(label='匯率轉換', text='匯率轉換'),
-            MessageAction(label='財經新聞', text='財經新聞')
-        ]
-    )
-    message = TemplateSendMessage(alt_text='主選單', template=buttons_template)
-    line_bot_api.reply_message(reply_token, message)
+# 固定的回覆在啟動時就建好；可選的貨幣或題目數量改變時會自動重建
+templates.register("main_menu", build_main_menu)
+templates.register("question", build_question, version=lambda: len(questions))
+templates.register("ask_currency", build_ask_currency, version=lambda: tuple(exchange_rates))
+templates.get("main_menu")
+templates.get("question", 0)
+templates.get("ask_currency", "請選擇來源貨幣", "from_currency")
+templates.get("ask_currency", "請選擇目標貨幣", "to_currency")
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -6,9 +6,9 @@ from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, PostbackEvent, PostbackAction,
     QuickReply, QuickReplyButton, MessageAction, ButtonsTemplate, TemplateSendMessage
 )
-import yfinance as yf
-import requests
-from bs4 import BeautifulSoup
+import http_client
+from ttl_cache import TTLCache
+from dedupe import EventDeduper
 
 app = Flask(__name__)
 
@@ -16,9 +16,20 @@ app = Flask(__name__)
 line_channel_access_token = os.getenv('CHANNEL_ACCESS_TOKEN')
 line_channel_secret = os.getenv('CHANNEL_SECRET')
 
-line_bot_api = LineBotApi(line_channel_access_token)
+line_bot_api = LineBotApi(line_channel_access_token, endpoint=http_client.LINE_API_ENDPOINT, timeout=http_client.DEFAULT_TIMEOUT, http_client=http_client.SessionHttpClient)
 handler = WebhookHandler(line_channel_secret)
 
+# 已處理過的 webhookEventId，重送的事件直接略過，避免重複計分
+deduper = EventDeduper()
+
+# 股票報價快取，稍微過期時先回舊資料並在背景更新
+quote_cache = TTLCache(
+    "quote",
+    ttl=int(os.getenv('QUOTE_CACHE_TTL', '60')),
+    stale_ttl=int(os.getenv('QUOTE_CACHE_STALE', '300')),
+    max_entries=int(os.getenv('QUOTE_CACHE_SIZE', '256'))
+)
+
 # 理財測驗題目和答案
 questions = [
     {"question": "1. 股票市場中，代表股價指數的英文縮寫是什麼？", "options": ["A) ROI", "B) GDP", "C) EPS", "D) Index"], "answer": "D"},
@@ -67,10 +78,11 @@ def get_financial_news():
     url = 'https://finance.yahoo.com/'
     financial_keywords = ['finance', 'financial', 'market', 'stock', 'economy', 'investment', 'money', 'business']
 
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code != 200:
         return None
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(response.content, 'html.parser')
     links = soup.find_all('a')
 
@@ -85,10 +97,13 @@ def get_financial_news():
     
     return news_links[:5]
 
+def fetch_stock_info(ticker):
+    import yfinance as yf
+    return yf.Ticker(ticker).info
+
 def get_stock_info(ticker):
     try:
-        stock = yf.Ticker(ticker)
-        info = stock.info
+        info = quote_cache.get(ticker.strip().upper(), fetch_stock_info)
         return (f"公司名稱: {info.get('longName', 'N/A')}\n"
                 f"市場價格: {info.get('currentPrice', 'N/A')}\n"
                 f"市值: {info.get('marketCap', 'N/A')}\n"
@@ -114,6 +129,8 @@ def callback():
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
+    if not deduper.is_new(event):
+        return
     user_id = event.source.user_id
     text = event.message.text.strip()
 
@@ -193,6 +210,8 @@ def handle_message(event):
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
+    if not deduper.is_new(event):
+        return
     user_id = event.source.user_id
     postback_data = event.postback.data
 
@@ -0,0 +1,51 @@
+import threading
+
+
+# 交叉匯率矩陣：matrix[i, j] 為 1 單位貨幣 i 可換得多少貨幣 j
+# 只在匯率快照更換時重建一次，換算全部幣別只需取出一列乘上金額
+class CrossRateMatrix:
+    def __init__(self, snapshot):
+        import numpy as np
+
+        self.snapshot = snapshot
+        self.currencies = tuple(snapshot.rates)
+        self.index = {currency: i for i, currency in enumerate(self.currencies)}
+        rates = np.array([snapshot.rates[currency] for currency in self.currencies], dtype=np.float64)
+        self.matrix = rates[np.newaxis, :] / rates[:, np.newaxis]
+
+        # "USD"、"美金"、"USD美金" 都對應到同一個幣別
+        self.aliases = {}
+        for currency in self.currencies:
+            self.aliases[currency] = currency
+            self.aliases[currency[:3].upper()] = currency
+            if len(currency) > 3:
+                self.aliases[currency[3:]] = currency
+
+    def resolve(self, name):
+        return self.aliases.get(name) or self.aliases.get(name.upper())
+
+    def convert(self, amount, from_currency, to_currency):
+        return amount * float(self.matrix[self.index[from_currency], self.index[to_currency]])
+
+    def convert_all(self, amount, from_currency):
+        row = self.matrix[self.index[from_currency]] * amount
+        return list(zip(self.currencies, row.tolist()))
+
+
+class CrossRateCache:
+    def __init__(self, provider):
+        self.provider = provider
+        self._matrix = None
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+
+    def get(self):
+        snapshot = self.provider.latest()
+        matrix = self._matrix
+        if matrix is not None and matrix.snapshot is snapshot:
+            return matrix
+        with self._lock:
+            if self._matrix is None or self._matrix.snapshot is not snapshot:
+                self._matrix = CrossRateMatrix(snapshot)
+                self.rebuilds += 1
+            return self._matrix
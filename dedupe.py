@@ -0,0 +1,30 @@
+import os
+
+from metrics import Counter
+from session_store import create_store
+
+# LINE 在 /callback 太慢時會重送事件，以 webhookEventId 過濾掉已經處理過的事件
+# 預設跟著 SESSION_STORE，設為 sqlite 時多個 worker 共用同一份紀錄；也可用 DEDUPE_STORE 另外指定
+DEDUPE_TTL = int(os.getenv('DEDUPE_TTL', '86400'))
+DEDUPE_MAX_ENTRIES = int(os.getenv('DEDUPE_MAX_ENTRIES', '20000'))
+
+
+class EventDeduper:
+    def __init__(self, namespace="webhook_events", ttl=DEDUPE_TTL, max_entries=DEDUPE_MAX_ENTRIES):
+        self.store = create_store(namespace, url=os.getenv('DEDUPE_STORE'), ttl=ttl, max_entries=max_entries)
+        self.duplicates = Counter()
+
+    def is_new(self, event):
+        event_id = getattr(event, 'webhook_event_id', None)
+        if not event_id:
+            return True
+        if self.store.add(event_id):
+            return True
+        self.duplicates.inc()
+        return False
+
+    def filter(self, events):
+        return [event for event in events if self.is_new(event)]
+
+    def stats(self):
+        return dict(self.store.stats(), duplicates=self.duplicates.value)
@@ -0,0 +1,193 @@
+import argparse
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# 本機的假 LINE Messaging API，壓測與端對端測試時讓 bot 設定 LINE_API_ENDPOINT 指到這裡
+# 和正式 API 一樣檢查 reply/push/multicast 的內容格式與 5 則訊息上限，可設定延遲與 429 比例，並記錄每次呼叫
+# 用法：python fake_line_api.py --port 8090 --latency 0.05 --throttle 0.01
+#      LINE_API_ENDPOINT=http://127.0.0.1:8090 gunicorn app:app
+
+MAX_MESSAGES = 5
+MAX_MULTICAST_TO = 500
+MAX_TEXT_LENGTH = 5000
+MAX_ALT_TEXT_LENGTH = 400
+MAX_QUICK_REPLY_ITEMS = 13
+MESSAGE_TYPES = {"text", "sticker", "image", "video", "audio", "location", "imagemap", "template", "flex"}
+# 各種訊息必填的欄位
+REQUIRED_FIELDS = {
+    "text": ("text",),
+    "sticker": ("packageId", "stickerId"),
+    "image": ("originalContentUrl", "previewImageUrl"),
+    "video": ("originalContentUrl", "previewImageUrl"),
+    "audio": ("originalContentUrl", "duration"),
+    "location": ("title", "address", "latitude", "longitude"),
+    "imagemap": ("baseUrl", "altText", "baseSize", "actions"),
+    "template": ("altText", "template"),
+    "flex": ("altText", "contents"),
+}
+
+
+def validate_messages(messages):
+    # 回傳 LINE 格式的錯誤明細 [{"message": ..., "property": ...}]，沒有錯誤時回傳空 list
+    if not isinstance(messages, list) or not messages:
+        return [{"message": "must be specified", "property": "messages"}]
+    if len(messages) > MAX_MESSAGES:
+        return [{"message": f"Size must be between 1 and {MAX_MESSAGES}", "property": "messages"}]
+    details = []
+    for index, message in enumerate(messages):
+        prefix = f"messages[{index}]"
+        if not isinstance(message, dict) or message.get("type") not in MESSAGE_TYPES:
+            details.append({"message": "Invalid message type", "property": f"{prefix}.type"})
+            continue
+        for field in REQUIRED_FIELDS[message["type"]]:
+            if message.get(field) in (None, ""):
+                details.append({"message": "must be specified", "property": f"{prefix}.{field}"})
+        if message["type"] == "text" and len(message.get("text") or "") > MAX_TEXT_LENGTH:
+            details.append({"message": f"Length must be between 0 and {MAX_TEXT_LENGTH}", "property": f"{prefix}.text"})
+        if len(message.get("altText") or "") > MAX_ALT_TEXT_LENGTH:
+            details.append({"message": f"Length must be between 0 and {MAX_ALT_TEXT_LENGTH}", "property": f"{prefix}.altText"})
+        for field in ("originalContentUrl", "previewImageUrl", "baseUrl"):
+            if message.get(field) and not str(message[field]).startswith("https://"):
+                details.append({"message": "must be HTTPS URL", "property": f"{prefix}.{field}"})
+        items = (message.get("quickReply") or {}).get("items", [])
+        if len(items) > MAX_QUICK_REPLY_ITEMS:
+            details.append({"message": f"Size must be between 1 and {MAX_QUICK_REPLY_ITEMS}", "property": f"{prefix}.quickReply.items"})
+    return details
+
+
+class _QuietHandler(WSGIRequestHandler):
+    # 在測試行程內啟動時不要每個請求都印一行 log
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class FakeLineApi:
+    def __init__(self, latency=0.0, throttle=0.0, seed=None):
+        # latency 秒數模擬網路與 LINE 伺服器處理時間；throttle 是回 429 的比例
+        self.latency = latency
+        self.throttle = throttle
+        self.calls = []
+        self._used_tokens = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.app = self._build_app()
+
+    def _build_app(self):
+        app = Flask(__name__)
+        app.add_url_rule('/v2/bot/message/reply', 'reply', self._reply, methods=['POST'])
+        app.add_url_rule('/v2/bot/message/push', 'push', self._push, methods=['POST'])
+        app.add_url_rule('/v2/bot/message/multicast', 'multicast', self._multicast, methods=['POST'])
+        app.add_url_rule('/_calls', 'calls', self._list_calls, methods=['GET'])
+        app.add_url_rule('/_calls', 'reset', self._reset_calls, methods=['DELETE'])
+        return app
+
+    def _record(self, kind, body, status):
+        with self._lock:
+            self.calls.append({"kind": kind, "body": body, "status": status, "at": time.time()})
+
+    def _error(self, kind, body, status, message, details=None):
+        self._record(kind, body, status)
+        payload = {"message": message}
+        if details:
+            payload["details"] = details
+        return jsonify(payload), status, {"X-Line-Request-Id": uuid.uuid4().hex}
+
+    def _handle(self, kind, check):
+        if self.latency:
+            time.sleep(self.latency)
+        body = request.get_json(silent=True)
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return self._error(kind, body, 401, "Authentication failed. Confirm that the access token in the authorization header is valid.")
+        if self.throttle and self._random.random() < self.throttle:
+            return self._error(kind, body, 429, "The API rate limit has been exceeded. Try again later.")
+        if not isinstance(body, dict):
+            return self._error(kind, body, 400, "The request body has 1 error(s)", [{"message": "must be JSON object"}])
+        details = check(body) + validate_messages(body.get("messages"))
+        if details:
+            return self._error(kind, body, 400, f"The request body has {len(details)} error(s)", details)
+        self._record(kind, body, 200)
+        return jsonify({}), 200, {"X-Line-Request-Id": uuid.uuid4().hex}
+
+    def _reply(self):
+        def check(body):
+            token = body.get("replyToken")
+            if not isinstance(token, str) or not token:
+                return [{"message": "must be specified", "property": "replyToken"}]
+            # reply token 只能使用一次
+            with self._lock:
+                if token in self._used_tokens:
+                    return [{"message": "Invalid reply token", "property": "replyToken"}]
+                self._used_tokens.add(token)
+            return []
+        return self._handle("reply", check)
+
+    def _push(self):
+        def check(body):
+            if not isinstance(body.get("to"), str) or not body["to"]:
+                return [{"message": "must be specified", "property": "to"}]
+            return []
+        return self._handle("push", check)
+
+    def _multicast(self):
+        def check(body):
+            to = body.get("to")
+            if not isinstance(to, list) or not 1 <= len(to) <= MAX_MULTICAST_TO:
+                return [{"message": f"Size must be between 1 and {MAX_MULTICAST_TO}", "property": "to"}]
+            return []
+        return self._handle("multicast", check)
+
+    def _list_calls(self):
+        kind = request.args.get("kind")
+        return jsonify(self.calls_of(kind) if kind else list(self.calls))
+
+    def _reset_calls(self):
+        self.reset()
+        return jsonify({})
+
+    def calls_of(self, kind, status=200):
+        with self._lock:
+            return [call for call in self.calls if call["kind"] == kind and call["status"] == status]
+
+    def messages_sent(self, kind="reply"):
+        return [message for call in self.calls_of(kind) for message in call["body"]["messages"]]
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self._used_tokens.clear()
+
+    def start(self, host='127.0.0.1', port=0):
+        # 在背景執行緒啟動，port=0 由系統挑一個空的 port，回傳可以直接當 endpoint 用的網址
+        self._server = make_server(host, port, self.app, threaded=True, request_handler=_QuietHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-line-api", daemon=True)
+        self._thread.start()
+        return f"http://{host}:{self._server.server_port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake LINE Messaging API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument('--throttle', type=float, default=0.0, help="fraction of calls answered with 429")
+    args = parser.parse_args()
+
+    fake = FakeLineApi(latency=args.latency, throttle=args.throttle)
+    make_server(args.host, args.port, fake.app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+# gunicorn 啟動時會自動讀取目前目錄的 gunicorn.conf.py
+# METRICS_DIR 有設定時：master 啟動先清空目錄，worker 結束前寫出最後的數值，master 再把它併進封存檔
+# metrics 在 hook 裡才 import，這時 gunicorn 已經把專案目錄加進 sys.path
+
+
+def on_starting(server):
+    import metrics
+    metrics.reset_dir()
+
+
+def worker_exit(server, worker):
+    import metrics
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.archive_worker(worker.pid)
@@ -0,0 +1,92 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+# 所有對外 HTTP 請求共用的連線池設定
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '10'))
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+# 壓測時可以指向本機的假 LINE API（fake_line_api.py），正式環境不用設定
+LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT', 'https://api.line.me').rstrip('/')
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+def _build_session():
+    # 只對 GET 等冪等請求重試，LINE 的 reply token 只能用一次，POST 不能重送
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        # 重試用完時回傳最後一次的回應，交給呼叫端依 status_code 處理，不要丟出 RetryError
+        raise_on_status=False,
+        # 不照 Retry-After 等待（預設上限 6 小時），只用上面的 backoff，最多等幾秒
+        respect_retry_after_header=False,
+    )
+    # urllib3 的 PoolManager 會替每個 host 各保留一個 keep-alive 連線池
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'User-Agent': 'Mozilla/5.0 (compatible; linebot-openai)',
+    })
+    return session
+
+
+def get_session():
+    global _session, _session_pid
+    # fork 之後不能共用父行程的 socket，每個 worker 行程建立自己的 Session
+    if _session_pid != os.getpid():
+        with _lock:
+            if _session_pid != os.getpid():
+                _session = _build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return get_session().post(url, **kwargs)
+
+
+# 讓 LineBotApi 也走共用的連線池
+class SessionHttpClient(RequestsHttpClient):
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__(timeout=timeout)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = get_session().get(
+            url, headers=headers, params=params, stream=stream, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = get_session().post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = get_session().delete(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = get_session().put(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
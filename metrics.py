@@ -0,0 +1,262 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 簡單的計數器與延遲直方圖，供 /stats 與 /metrics 端點使用
+# 鎖只包住幾個加法，不在鎖內做任何 I/O 或配置記憶體
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 多個 gunicorn worker 各自把數值寫到這個目錄，/metrics 讀取全部檔案加總；未設定時只回報本行程
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            count, total, largest = self.count, self.sum, self.max
+        return {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 2) if count else 0.0,
+            "max_ms": round(largest * 1000, 2),
+        }
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.monotonic() - self.start)
+        return False
+
+
+class Family:
+    # 依標籤值分開統計，例如每個外部服務各一個 Histogram
+    def __init__(self, factory):
+        self.factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, self.factory())
+        return child
+
+    def items(self):
+        return list(self._children.items())
+
+
+# 對外部服務（yfinance、Yahoo 新聞、匯率、LINE API）的每次呼叫計時，例外也計入錯誤數
+upstream_latency = Family(Histogram)
+upstream_errors = Family(Counter)
+
+
+@contextmanager
+def track(upstream):
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        upstream_errors.labels(upstream).inc()
+        raise
+    finally:
+        upstream_latency.labels(upstream).observe(time.monotonic() - started)
+
+
+# Prometheus 文字格式的輸出；register() 的 collect 回傳 [(labels dict, Counter 或 Histogram)]
+_collectors = []
+
+
+def register(name, kind, help_text, collect):
+    _collectors.append((name, kind, help_text, collect))
+
+
+register(
+    "linebot_upstream_seconds", "histogram", "Latency of calls to external services.",
+    lambda: [({"upstream": name}, histogram) for name, histogram in upstream_latency.items()]
+)
+register(
+    "linebot_upstream_errors_total", "counter", "Failed calls to external services.",
+    lambda: [({"upstream": name}, counter) for name, counter in upstream_errors.items()]
+)
+
+
+def collect():
+    # 轉成可以寫進 JSON 的格式：{name: [kind, help, [[labels, value 或 histogram], ...]]}
+    families = {}
+    for name, kind, help_text, collect_family in _collectors:
+        samples = families.setdefault(name, [kind, help_text, []])[2]
+        for labels, metric in collect_family():
+            if kind == "histogram":
+                with metric._lock:
+                    value = [list(metric.buckets), list(metric.bucket_counts), metric.sum, metric.count]
+            else:
+                value = metric.value
+            samples.append([labels, value])
+    return families
+
+
+def _merge(total, families):
+    for name, (kind, help_text, samples) in families.items():
+        merged = total.setdefault(name, [kind, help_text, {}])[2]
+        for labels, value in samples:
+            key = tuple(sorted(labels.items()))
+            current = merged.get(key)
+            if current is None:
+                merged[key] = value
+            elif kind == "histogram":
+                merged[key] = [
+                    current[0],
+                    [a + b for a, b in zip(current[1], value[1])],
+                    current[2] + value[2],
+                    current[3] + value[3],
+                ]
+            else:
+                merged[key] = current + value
+    return total
+
+
+def _worker_path(pid=None):
+    return os.path.join(METRICS_DIR, f"metrics-{pid or os.getpid()}.json")
+
+
+# 已結束的 worker 的數值合併進同一個封存檔，目錄裡不會隨著 worker 重啟一直多出檔案，
+# 新 worker 沿用舊的 PID 時也不會蓋掉舊數值讓計數器倒退
+ARCHIVE_FILE = "metrics-archive.json"
+
+
+def _write_json(path, data):
+    # 寫到暫存檔再改名，其他 worker 讀取時不會讀到寫一半的檔案
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _samples(total):
+    # _merge 的結果轉回 collect() 的格式才能寫進 JSON
+    return {
+        name: [kind, help_text, [[dict(key), value] for key, value in samples.items()]]
+        for name, (kind, help_text, samples) in total.items()
+    }
+
+
+def flush():
+    if not METRICS_DIR:
+        return
+    _write_json(_worker_path(), collect())
+
+
+def reset_dir():
+    # gunicorn master 啟動時呼叫，清掉上一次執行留下的檔案
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for filename in os.listdir(METRICS_DIR):
+        if filename.startswith("metrics-"):
+            os.remove(os.path.join(METRICS_DIR, filename))
+
+
+def archive_worker(pid):
+    # gunicorn master 在 worker 結束後呼叫（只有 master 會寫封存檔），把該 worker 最後的數值併進封存檔
+    if not METRICS_DIR:
+        return
+    path = _worker_path(pid)
+    try:
+        with open(path) as f:
+            families = json.load(f)
+    except (OSError, ValueError):
+        return
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    total = {}
+    try:
+        with open(archive_path) as f:
+            _merge(total, json.load(f))
+    except (OSError, ValueError):
+        pass
+    _write_json(archive_path, _samples(_merge(total, families)))
+    os.remove(path)
+
+
+def aggregate():
+    # 本行程用即時數值，其他 worker 用最近一次 flush 的檔案，已結束的 worker 在封存檔裡
+    total = _merge({}, collect())
+    if METRICS_DIR:
+        own = os.path.basename(_worker_path())
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.startswith("metrics-") or not filename.endswith(".json") or filename == own:
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    _merge(total, json.load(f))
+            except (OSError, ValueError):
+                continue
+    return total
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def render(families):
+    lines = []
+    for name, (kind, help_text, samples) in sorted(families.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(samples.items()):
+            if kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            bounds, counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(bounds) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
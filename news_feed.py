@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+import requests
+
+import http_client
+from circuit_breaker import CircuitOpen
+from metrics import Counter, track
+from scheduler import PeriodicTask
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# 財經新聞快照：背景定期以條件請求更新，使用者只讀取最新的快照
+class NewsFeed:
+    def __init__(self, url, parse, interval=300, breaker=None):
+        self.url = url
+        self.parse = parse
+        # 斷路器跳開時不連線，保留上一份快照
+        self.breaker = breaker
+        self.interval = interval
+        self.links = None
+        self.updated_at = None
+        self.checked_at = None
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        self._lock = threading.Lock()
+        self._task = PeriodicTask("news-feed", self.refresh, interval)
+        # 背景排程與第一次請求同時更新時只抓一次，其他人等同一個結果
+        self._flight = SingleFlight("news")
+        self.not_modified = Counter()
+        self.unchanged = Counter()
+        self.parsed = Counter()
+        self.errors = Counter()
+        self.skipped = Counter()
+
+    def latest(self):
+        self._task.start()
+        if self.links is None:
+            # 第一次請求時還沒有快照，先同步抓一次
+            self.refresh()
+        return self.links
+
+    def refresh(self):
+        self._flight.do(self.url, self._refresh)
+
+    def _refresh(self):
+        with self._lock:
+            try:
+                if self.breaker is not None:
+                    response = self.breaker.call(self._fetch, self._headers())
+                else:
+                    response = self._fetch(self._headers())
+            except CircuitOpen:
+                self.skipped.inc()
+                return
+            except requests.RequestException as e:
+                self.errors.inc()
+                logger.warning("news refresh failed: %s", e)
+                return
+            self._apply(response)
+
+    async def refresh_async(self, get):
+        # asyncio 模式：get 為 async_http.get，等待 Yahoo 回應時不佔用執行緒；解析交給執行緒，不卡住事件迴圈
+        try:
+            if self.breaker is not None:
+                response = await self.breaker.call_async(self._fetch_async, get, self._headers())
+            else:
+                response = await self._fetch_async(get, self._headers())
+        except CircuitOpen:
+            self.skipped.inc()
+            return
+        except requests.RequestException as e:
+            self.errors.inc()
+            logger.warning("news refresh failed: %s", e)
+            return
+        await asyncio.to_thread(self._apply_locked, response)
+
+    def stop_background(self):
+        # 改由 asyncio 事件迴圈定期呼叫 refresh_async
+        self._task.disable()
+
+    def _headers(self):
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+        return headers
+
+    def _apply_locked(self, response):
+        with self._lock:
+            self._apply(response)
+
+    def _apply(self, response):
+        self.checked_at = time.time()
+
+        if response.status_code == 304:
+            self.not_modified.inc()
+            return
+
+        self._etag = response.headers.get('ETag')
+        self._last_modified = response.headers.get('Last-Modified')
+        # 沒有 ETag 的網站每次都回完整內容，比對雜湊值決定是否要重新解析
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest == self._digest and self.links is not None:
+            self.unchanged.inc()
+            return
+
+        self.links = self.parse(response.content)
+        self._digest = digest
+        self.updated_at = self.checked_at
+        self.parsed.inc()
+
+    def _fetch(self, headers):
+        # 被擋或伺服器錯誤也算失敗，讓斷路器計入
+        with track("yahoo_news"):
+            response = http_client.get(self.url, headers=headers)
+        return self._check(response)
+
+    async def _fetch_async(self, get, headers):
+        with track("yahoo_news"):
+            response = await get(self.url, headers=headers)
+        return self._check(response)
+
+    def _check(self, response):
+        if response.status_code not in (200, 304):
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+        return response
+
+    def stats(self):
+        return {
+            "links": len(self.links) if self.links else 0,
+            "updated_at": self.updated_at,
+            "checked_at": self.checked_at,
+            "not_modified": self.not_modified.value,
+            "unchanged": self.unchanged.value,
+            "parsed": self.parsed.value,
+            "errors": self.errors.value,
+            "skipped": self.skipped.value,
+            "coalesced": self._flight.coalesced.value,
+        }
@@ -0,0 +1,117 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(Exception):
+    pass
+
+
+# CPU 密集的工作（畫圖、pandas 計算）交給子行程，不會卡住同一個 gunicorn worker 的其他事件
+# 同時進行的工作最多 max_pending 個；子行程處理 max_tasks_per_child 個工作後換新，
+# 避免 matplotlib 的記憶體一直累積
+class ProcessPool:
+    def __init__(self, name, workers=2, max_pending=8, timeout=30, max_tasks_per_child=50):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.submitted = Counter()
+        self.completed = Counter()
+        self.failed = Counter()
+        self.timeouts = Counter()
+        self.rejected = Counter()
+        self.restarts = Counter()
+        self.run_time = Histogram()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 之後父行程的子行程與名額都不能沿用
+                self._executor = None
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._pid = os.getpid()
+            if self._executor is None:
+                # spawn 的子行程不會繼承 worker 的執行緒、鎖與網路連線
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            return self._executor
+
+    def submit(self, func, *args):
+        # 不會阻塞：名額用完時丟出 PoolBusy，由呼叫端決定改回快取或請使用者稍後再試
+        # func 與參數、回傳值都要能 pickle，也就是模組層級的函式
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self.rejected.inc()
+            raise PoolBusy(f"{self.name} pool is busy")
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            slots.release()
+            raise
+        self.submitted.inc()
+        started = time.monotonic()
+        future.add_done_callback(lambda done: self._finish(done, slots, started))
+        future.executor = executor
+        return future
+
+    def _finish(self, future, slots, started):
+        slots.release()
+        self.run_time.observe(time.monotonic() - started)
+        if future.cancelled() or future.exception() is not None:
+            self.failed.inc()
+        else:
+            self.completed.inc()
+
+    def run(self, func, *args, timeout=None):
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout or self.timeout)
+        except TimeoutError:
+            self.timeouts.inc()
+            self._restart(future.executor)
+            raise
+
+    def _restart(self, executor):
+        # 已經開始執行的工作無法取消，逾時就結束整組子行程，下一次 submit 時重建
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logger.warning("%s task timed out, restarting workers", self.name)
+        processes = getattr(executor, "_processes", None) or {}
+        for process in list(processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.restarts.inc()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "timeout": self.timeout,
+            "submitted": self.submitted.value,
+            "completed": self.completed.value,
+            "failed": self.failed.value,
+            "timeouts": self.timeouts.value,
+            "rejected": self.rejected.value,
+            "restarts": self.restarts.value,
+            "run_time": self.run_time.snapshot(),
+        }
@@ -0,0 +1,113 @@
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import time
+
+from flask import g, request
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# 線上抽樣 profiling：PROFILE_SAMPLE_RATE 比例的 PROFILE_ROUTES 請求，或帶有正確 X-Profile-Token 標頭的任何請求，
+# 會用 cProfile 記錄整個請求，每個路由各存一個目錄（.prof 給 snakeviz/pstats，.txt 是依累計時間排序的摘要）
+# 兩者都沒設定時不註冊任何 hook，請求完全不受影響
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ROUTES = [route for route in os.getenv('PROFILE_ROUTES', '/callback').split(',') if route]
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/linebot-profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+PROFILE_HEADER = 'X-Profile-Token'
+
+
+class RequestProfiler:
+    def __init__(self, directory, sample_rate=0.0, routes=('/callback',), token=None, keep=50):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.routes = set(routes)
+        self.token = token
+        self.keep = keep
+        self.profiled = Counter()
+        self.skipped = Counter()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.token)
+
+    def install(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.teardown_request(self._stop)
+
+    def _route(self):
+        return request.url_rule.rule if request.url_rule is not None else request.path
+
+    def _wanted(self):
+        if self.token:
+            supplied = request.headers.get(PROFILE_HEADER)
+            if supplied and hmac.compare_digest(supplied, self.token):
+                return True
+        return self._route() in self.routes and random.random() < self.sample_rate
+
+    def _start(self):
+        if not self._wanted():
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12 之後同一時間只能有一個 profiler，其他執行緒正在 profiling 時這次略過
+            self.skipped.inc()
+            return
+        g._profiler = profiler
+        g._profile_started = time.perf_counter()
+
+    def _stop(self, exc=None):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        elapsed = time.perf_counter() - g.pop('_profile_started')
+        self.profiled.inc()
+        try:
+            self._write(self._route(), profiler, elapsed)
+        except OSError as e:
+            logger.warning("could not write profile: %s", e)
+
+    def _write(self, route, profiler, elapsed):
+        directory = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]+', '_', route).strip('_') or 'root')
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now % 1 * 1000):03d}-{os.getpid()}-{int(elapsed * 1000)}ms"
+        summary = io.StringIO()
+        summary.write(f"{request.method} {request.path} {elapsed * 1000:.1f} ms\n\n")
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+        with open(os.path.join(directory, f"{name}.txt"), 'w') as f:
+            f.write(summary.getvalue())
+        # .prof 最後才寫，清理舊檔時看到的 .prof 一定已經有對應的 .txt
+        profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
+
+        # 每個路由只保留最新的 keep 份；檔名以時間開頭，依檔名排序就是新舊順序
+        profiles = sorted(filename[:-len('.prof')] for filename in os.listdir(directory) if filename.endswith('.prof'))
+        for old in profiles[:-self.keep]:
+            for extension in ('.prof', '.txt'):
+                try:
+                    os.remove(os.path.join(directory, old + extension))
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "routes": sorted(self.routes),
+            "directory": self.directory,
+            "profiled": self.profiled.value,
+            "skipped": self.skipped.value,
+        }
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import Counter
+
+
+# 每位使用者一個 token bucket：每秒補 rate 個，最多累積 burst 個
+# 每位使用者只存一個 (tokens, updated_at) tuple，超過 max_users 時淘汰最久沒出現的使用者
+class RateLimiter:
+    def __init__(self, name, rate, burst, max_users=10000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = Counter()
+        self.limited = Counter()
+
+    def allow(self, key, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        (self.allowed if allowed else self.limited).inc()
+        return allowed
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "users": len(self._buckets),
+            "max_users": self.max_users,
+            "allowed": self.allowed.value,
+            "limited": self.limited.value,
+        }
+
+
+# 對同一個外部服務同時進行的請求數上限，名額用完時不排隊，直接讓呼叫端改用快取
+class ConcurrencyLimit:
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = Counter()
+
+    @contextmanager
+    def acquire(self):
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            self.rejected.inc()
+            yield False
+            return
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self._in_flight, "rejected": self.rejected.value}
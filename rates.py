@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import http_client
+from metrics import Counter, track
+from scheduler import PeriodicTask
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 多個 RateProvider 使用同一個來源時，同時更新只下載一次，各自解析
+_flight = SingleFlight("rates")
+
+RateSnapshot = namedtuple("RateSnapshot", "rates updated_at source")
+
+
+# 匯率來源：背景定期更新，換算時只讀記憶體中的最新快照，不做任何網路請求
+# 來源失敗時保留上一份成功的快照；從未成功過則使用固定匯率表
+class RateProvider:
+    def __init__(self, name, url, parse, fallback, interval=3600):
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.fallback = dict(fallback)
+        self.interval = interval
+        self.snapshot = RateSnapshot(self.fallback, None, "static")
+        self._lock = threading.Lock()
+        self._task = PeriodicTask(f"{name}-rates", self.refresh, interval, run_at_start=True)
+        self.refreshes = Counter()
+        self.errors = Counter()
+
+    def latest(self):
+        self._task.start()
+        return self.snapshot
+
+    def rates(self):
+        return self.latest().rates
+
+    def refresh(self):
+        with self._lock:
+            try:
+                parsed = self.parse(_flight.do(self.url, _fetch_json, self.url))
+            except Exception:
+                self.errors.inc()
+                logger.exception("%s rate refresh failed", self.name)
+                return
+            self._apply(parsed)
+
+    async def refresh_async(self, get):
+        # asyncio 模式：get 為 async_http.get，不佔用執行緒
+        try:
+            with track("rates"):
+                response = await get(self.url)
+            parsed = self.parse(_json(response))
+        except Exception:
+            self.errors.inc()
+            logger.exception("%s rate refresh failed", self.name)
+            return
+        with self._lock:
+            self._apply(parsed)
+
+    def stop_background(self):
+        # 改由 asyncio 事件迴圈定期呼叫 refresh_async
+        self._task.disable()
+
+    def _apply(self, parsed):
+        if not parsed:
+            self.errors.inc()
+            logger.warning("%s rate feed returned no usable rates", self.name)
+            return
+        # 來源沒有提供的幣別沿用固定匯率
+        rates = dict(self.fallback)
+        rates.update(parsed)
+        self.snapshot = RateSnapshot(rates, time.time(), self.url)
+        self.refreshes.inc()
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "source": snapshot.source,
+            "updated_at": snapshot.updated_at,
+            "currencies": len(snapshot.rates),
+            "refreshes": self.refreshes.value,
+            "errors": self.errors.value,
+        }
+
+
+def _fetch_json(url):
+    with track("rates"):
+        response = http_client.get(url)
+    return _json(response)
+
+
+def _json(response):
+    response.raise_for_status()
+    return response.json()
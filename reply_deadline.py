@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from metrics import Counter
+from worker_pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+# 用一條背景執行緒管理所有事件的回覆期限，不必每個事件各開一個 Timer
+class DeadlineWatcher:
+    def __init__(self, name):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._heap = []
+            thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def watch(self, expires_at, callback):
+        # 回傳的 ticket 交給 cancel()；取消只做標記，到期時跳過
+        self._ensure_started()
+        ticket = [expires_at, next(self._seq), callback, True]
+        with self._cond:
+            heapq.heappush(self._heap, ticket)
+            if self._heap[0] is ticket:
+                self._cond.notify()
+        return ticket
+
+    def cancel(self, ticket):
+        ticket[3] = False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, callback, active = heapq.heappop(self._heap)
+            if active:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("%s callback failed", self.name)
+
+
+class ReplyBudget:
+    def __init__(self, name, budget, reply, push, placeholder, senders=4, placeholder_wait=15):
+        self.budget = budget
+        self.reply = reply
+        self.push = push
+        self.placeholder = placeholder
+        # placeholder_wait：push 前最多等 placeholder 送出幾秒，避免 LINE 卡住時結果一直送不出去
+        self.placeholder_wait = placeholder_wait
+        self.watcher = DeadlineWatcher(f"{name}-deadline")
+        # 期限執行緒只負責標記逾時，送 placeholder 這種會卡在 LINE API 的工作交給另外的執行緒
+        self.senders = WorkerPool(f"{name}-placeholder", workers=senders, max_queue=1000)
+        self.in_time = Counter()
+        self.late = Counter()
+        self.pushed = Counter()
+        self.push_failed = Counter()
+
+    def respond(self, reply_token, to, produce, started_at=None):
+        # 期限內完成就用 reply token 回覆；來不及時先回 placeholder，做完再用 push_message 送出
+        # started_at 為 LINE 送出事件的時間，在佇列裡等待的時間也算在期限內
+        started_at = started_at or time.time()
+        remaining = self.budget - (time.time() - started_at)
+        delivery = _Delivery(self, reply_token, to, time.monotonic() + max(remaining, 0))
+        ticket = self.watcher.watch(delivery.expires_at, delivery.expire)
+        try:
+            messages = produce()
+        finally:
+            self.watcher.cancel(ticket)
+        delivery.finish(messages)
+
+    def stats(self):
+        return {
+            "budget": self.budget,
+            "in_time": self.in_time.value,
+            "late": self.late.value,
+            "pushed": self.pushed.value,
+            "push_failed": self.push_failed.value,
+        }
+
+
+class _Delivery:
+    def __init__(self, budget, reply_token, to, expires_at):
+        self.budget = budget
+        self.reply_token = reply_token
+        self.to = to
+        self.expires_at = expires_at
+        self._lock = threading.Lock()
+        self._late = False
+        self._done = False
+        # placeholder 送完（成功或失敗）才設定，push 要等它，使用者才不會先看到結果再看到「查詢中…」
+        self._placeholder_sent = threading.Event()
+
+    def _mark_late(self):
+        # 呼叫前要持有 _lock；回傳 True 表示由呼叫端負責送 placeholder
+        if self._late:
+            return False
+        self._late = True
+        self.budget.late.inc()
+        return True
+
+    def expire(self):
+        # 在期限執行緒裡執行：只做標記，placeholder 交給 senders 送出
+        with self._lock:
+            if self._done or not self._mark_late():
+                return
+        self.budget.senders.submit(self._send_placeholder)
+
+    def _send_placeholder(self):
+        # 送失敗（例如 reply token 已過期）也要繼續 push 結果
+        try:
+            self.budget.reply(self.reply_token, self.budget.placeholder)
+        except Exception:
+            logger.exception("placeholder reply failed")
+        finally:
+            self._placeholder_sent.set()
+
+    def finish(self, messages):
+        with self._lock:
+            self._done = True
+            # 期限已過但期限執行緒還沒處理到，同樣算逾時，由這裡送 placeholder
+            send_placeholder = time.monotonic() >= self.expires_at and self._mark_late()
+            late = self._late
+        if not late:
+            if messages:
+                self.budget.in_time.inc()
+                self.budget.reply(self.reply_token, messages)
+            return
+        if send_placeholder:
+            self._send_placeholder()
+        if not messages or self.to is None:
+            return
+        if not self._placeholder_sent.wait(self.budget.placeholder_wait):
+            logger.warning("placeholder reply still pending, pushing anyway")
+        try:
+            self.budget.push(self.to, messages)
+            self.budget.pushed.inc()
+        except Exception:
+            self.budget.push_failed.inc()
+            raise
@@ -0,0 +1,109 @@
+import json
+import threading
+
+from metrics import Counter, track
+
+# 主選單、貨幣選單這類固定的回覆，只在啟動或資料變更時建立並轉成 JSON 一次
+# 回覆時只把 reply token 拼進去，不必每次重建 ButtonsTemplate / QuickReply 再序列化
+
+REPLY_PATH = '/v2/bot/message/reply'
+PUSH_PATH = '/v2/bot/message/push'
+
+
+def serialize(message):
+    return json.dumps(message.as_json_dict(), ensure_ascii=False, separators=(',', ':'))
+
+
+class PrebuiltMessage:
+    # 已序列化好的單一則訊息，可以和一般的 SendMessage 混在同一個回覆裡
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class ReplyTemplates:
+    def __init__(self):
+        self._builders = {}
+        self._built = {}
+        self._lock = threading.Lock()
+        self.builds = Counter()
+        self.hits = Counter()
+
+    def register(self, name, build, version=None):
+        # version() 的回傳值改變時重建，例如貨幣清單或題目數量變了
+        self._builders[name] = (build, version)
+
+    def get(self, name, *args):
+        build, version = self._builders[name]
+        key = (name,) + args
+        current = version() if version is not None else None
+        entry = self._built.get(key)
+        if entry is not None and entry[0] == current:
+            self.hits.inc()
+            return entry[1]
+        message = PrebuiltMessage(serialize(build(*args)))
+        with self._lock:
+            self._built[key] = (current, message)
+        self.builds.inc()
+        return message
+
+    def invalidate(self, name=None):
+        # 直接修改題目內容等 version() 看不出來的變更時手動清除
+        with self._lock:
+            for key in [key for key in self._built if name is None or key[0] == name]:
+                del self._built[key]
+
+    def stats(self):
+        return {
+            "templates": len(self._builders),
+            "built": len(self._built),
+            "builds": self.builds.value,
+            "hits": self.hits.value,
+        }
+
+
+def _body(head, messages):
+    parts = [message.payload if isinstance(message, PrebuiltMessage) else serialize(message) for message in messages]
+    return ('{%s,"messages":[%s]}' % (head, ','.join(parts))).encode('utf-8')
+
+
+def _post_messages(line_bot_api, path, head, messages):
+    line_bot_api._post(path, data=_body(head, messages))
+
+
+def _has_prebuilt(messages):
+    return any(isinstance(message, PrebuiltMessage) for message in messages)
+
+
+def reply(line_bot_api, reply_token, messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with track("line_reply"):
+        if not _has_prebuilt(messages):
+            line_bot_api.reply_message(reply_token, messages)
+            return
+        _post_messages(line_bot_api, REPLY_PATH, '"replyToken":%s' % json.dumps(reply_token), messages)
+
+
+def push(line_bot_api, to, messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with track("line_push"):
+        if not _has_prebuilt(messages):
+            line_bot_api.push_message(to, messages)
+            return
+        _post_messages(line_bot_api, PUSH_PATH, '"to":%s' % json.dumps(to), messages)
+
+
+# asyncio 模式（asgi.py）用 AsyncLineBotApi 送出，一律走 _body 序列化
+async def reply_async(line_bot_api, reply_token, messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with track("line_reply"):
+        await line_bot_api._post(REPLY_PATH, data=_body('"replyToken":%s' % json.dumps(reply_token), messages))
+
+
+async def push_async(line_bot_api, to, messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    with track("line_push"):
+        await line_bot_api._post(PUSH_PATH, data=_body('"to":%s' % json.dumps(to), messages))
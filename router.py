@@ -0,0 +1,96 @@
+from metrics import Histogram
+
+# 訊息分派表：指令用完全比對，對話中的輸入用 (狀態, 輸入類型) 查表，都是 O(1)
+# 指令優先於狀態，使用者在任何步驟輸入主選單上的指令都能直接切換功能
+
+TEXT = "text"
+NUMBER = "number"
+
+
+def input_kind(text):
+    try:
+        float(text)
+        return NUMBER
+    except ValueError:
+        return TEXT
+
+
+def decode_postback(data):
+    # "from_currency=USD美金" -> ("from_currency", "USD美金")；沒有 "=" 時 value 為空字串
+    key, _, value = data.partition("=")
+    return key, value
+
+
+class Router:
+    def __init__(self):
+        self.commands = {}
+        self.prefixes = {}
+        self.suffixes = {}
+        self.states = {}
+        self.postbacks = {}
+        self.default = None
+        self.default_postback = None
+        self.latency = {}
+
+    def _register(self, table, keys, func):
+        self.latency.setdefault(func.__name__, Histogram())
+        for key in keys:
+            table[key] = func
+        return func
+
+    def command(self, *texts):
+        return lambda func: self._register(self.commands, texts, func)
+
+    def prefix(self, *words):
+        # 以第一個詞決定功能，例如 "走勢圖 AAPL 1y"
+        return lambda func: self._register(self.prefixes, words, func)
+
+    def suffix(self, *words):
+        # 以最後一個詞決定功能，例如 "100 USD 全部"
+        return lambda func: self._register(self.suffixes, words, func)
+
+    def state(self, step, *kinds):
+        kinds = kinds or (TEXT, NUMBER)
+        return lambda func: self._register(self.states, [(step, kind) for kind in kinds], func)
+
+    def postback(self, *keys):
+        return lambda func: self._register(self.postbacks, keys, func)
+
+    def fallback(self, func):
+        self.default = self._register({}, (), func)
+        return func
+
+    def postback_fallback(self, func):
+        self.default_postback = self._register({}, (), func)
+        return func
+
+    def resolve_message(self, text, step):
+        func = self.commands.get(text)
+        if func is None and self.prefixes:
+            func = self.prefixes.get(text.partition(" ")[0])
+        if func is None and self.suffixes and " " in text:
+            func = self.suffixes.get(text.rpartition(" ")[2])
+        if func is None and step is not None:
+            func = self.states.get((step, input_kind(text)))
+        return func or self.default
+
+    def dispatch_message(self, event, text, state, step):
+        func = self.resolve_message(text, step)
+        if func is None:
+            return None
+        with self.latency[func.__name__].time():
+            return func(event, text, state)
+
+    def dispatch_postback(self, event, data):
+        key, value = decode_postback(data)
+        func = self.postbacks.get(key)
+        if func is None:
+            func = self.default_postback
+            value = data
+        if func is None:
+            return None
+        with self.latency[func.__name__].time():
+            return func(event, value)
+
+    def stats(self):
+        return {name: histogram.snapshot() for name, histogram in self.latency.items()}
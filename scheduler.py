@@ -0,0 +1,50 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# 定期在背景執行的工作，例如更新新聞快照
+class PeriodicTask:
+    def __init__(self, name, func, interval, run_at_start=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_at_start = run_at_start
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self._disabled = False
+
+    def start(self):
+        # 與 WorkerPool 一樣，每個 gunicorn worker 行程各自啟動一次
+        if self._disabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+
+    def disable(self):
+        # 改由其他排程（例如 asgi.py 的事件迴圈）定期呼叫時，不再開背景執行緒
+        self._disabled = True
+        self._stop.set()
+
+    def _run(self):
+        if self.run_at_start:
+            self._call()
+        while not self._stop.wait(self.interval):
+            self._call()
+
+    def _call(self):
+        try:
+            self.func()
+        except Exception:
+            logger.exception("%s failed", self.name)
@@ -0,0 +1,262 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# 對話狀態儲存：memory 只在單一行程內有效，sqlite 可讓多個 gunicorn worker 共用
+# SESSION_STORE=memory 或 SESSION_STORE=sqlite:////tmp/linebot_sessions.db（四個斜線為絕對路徑）
+# 超過 SESSION_TTL 秒沒有更新的對話視為放棄；超過 SESSION_MAX_ENTRIES 筆時淘汰最久沒動的
+
+DEFAULT_TTL = int(os.getenv('SESSION_TTL', '3600'))
+MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+SWEEP_INTERVAL = 60
+
+
+class _Store:
+    # record 為 namedtuple 類別時，狀態以 tuple 形式保存，比 dict 省記憶體
+    record = None
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def delete(self, key):
+        self.set(key, None)
+
+    def merge(self, key, **fields):
+        # 原子地更新部分欄位，回傳更新後的結果
+        def apply(value):
+            if self.record is not None:
+                return (value or self.record())._replace(**fields)
+            value = dict(value) if isinstance(value, dict) else {}
+            value.update(fields)
+            return value
+        return self.update(key, apply)
+
+    def add(self, key, ttl=None):
+        # 不存在時才寫入，回傳是否為第一次出現；讀取與寫入在同一次 update 內完成
+        added = []
+
+        def apply(value):
+            if value is None:
+                added.append(key)
+                return 1
+            return value
+        self.update(key, apply, ttl)
+        return bool(added)
+
+
+class MemoryStore(_Store):
+    def __init__(self, namespace, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, record=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.record = record
+        # 依最後寫入時間排序，最前面的就是閒置最久的對話
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.expired = 0
+        self.evicted = 0
+
+    def _load(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            self.expired += 1
+            return None
+        return value
+
+    def _save(self, key, value, ttl, now):
+        if value is None:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (self._expires_at(ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evicted += 1
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._sweep(now)
+
+    def _sweep(self, now):
+        # 只需從最前面開始刪到第一筆未過期的為止
+        self._last_sweep = now
+        while self._data:
+            expires_at, _ = next(iter(self._data.values()))
+            if expires_at is None or expires_at > now:
+                break
+            self._data.popitem(last=False)
+            self.expired += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._load(key, time.time())
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._save(key, value, ttl, time.time())
+
+    def update(self, key, func, ttl=None):
+        # 讀取、修改、寫回在同一把鎖內完成；func 回傳 None 代表刪除
+        with self._lock:
+            now = time.time()
+            value = func(self._load(key, now))
+            self._save(key, value, ttl, now)
+            return value
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            self._sweep(time.time())
+            items = list(self._data.items())
+            table_bytes = sys.getsizeof(self._data)
+        # 粗估：OrderedDict 本身加上每筆的 key、(expires_at, value) tuple 與欄位內容
+        estimated = table_bytes
+        for key, (expires_at, value) in items:
+            estimated += sys.getsizeof(key) + sys.getsizeof(expires_at) + 56 + sys.getsizeof(value)
+            if isinstance(value, tuple):
+                estimated += sum(sys.getsizeof(field) for field in value if field is not None)
+        return {
+            "sessions": len(items),
+            "max_entries": self.max_entries,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "estimated_bytes": estimated,
+        }
+
+
+class SQLiteStore(_Store):
+    def __init__(self, namespace, path, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, record=None):
+        self.namespace = namespace
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.record = record
+        self._local = threading.local()
+        self._last_sweep = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (namespace, expires_at)")
+
+    def _connect(self):
+        # sqlite3 連線不能跨執行緒或跨 fork 共用，每個執行緒各自開一條
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _encode(self, value):
+        return json.dumps(list(value) if self.record is not None else value, ensure_ascii=False)
+
+    def _decode(self, text):
+        value = json.loads(text)
+        return self.record(*value) if self.record is not None else value
+
+    def _load(self, conn, key):
+        row = conn.execute(
+            "SELECT value, expires_at FROM sessions WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return self._decode(value)
+
+    def _store(self, conn, key, value, ttl):
+        if value is None:
+            conn.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (self.namespace, key))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, self._encode(value), self._expires_at(ttl))
+            )
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.purge_expired()
+
+    def get(self, key, default=None):
+        value = self._load(self._connect(), key)
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        self._store(self._connect(), key, value, ttl)
+        self._maybe_sweep()
+
+    def update(self, key, func, ttl=None):
+        # BEGIN IMMEDIATE 先取得寫入鎖，其他行程的 update 會等到 COMMIT 之後
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = func(self._load(conn, key))
+            self._store(conn, key, value, ttl)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_sweep()
+        return value
+
+    def purge_expired(self):
+        conn = self._connect()
+        conn.execute(
+            "DELETE FROM sessions WHERE namespace = ? AND expires_at <= ?", (self.namespace, time.time())
+        )
+        # 超過上限時刪掉最快過期（也就是閒置最久）的對話
+        conn.execute(
+            "DELETE FROM sessions WHERE namespace = ? AND key IN ("
+            " SELECT key FROM sessions WHERE namespace = ? ORDER BY expires_at"
+            " LIMIT max(0, (SELECT COUNT(*) FROM sessions WHERE namespace = ?) - ?))",
+            (self.namespace, self.namespace, self.namespace, self.max_entries)
+        )
+
+    def __len__(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM sessions WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.namespace, time.time())
+        ).fetchone()
+        return row[0]
+
+    def stats(self):
+        count, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(key) + LENGTH(value) + 8), 0) FROM sessions WHERE namespace = ?",
+            (self.namespace,)
+        ).fetchone()
+        return {
+            "sessions": len(self),
+            "stored_rows": count,
+            "max_entries": self.max_entries,
+            "estimated_bytes": size,
+        }
+
+
+def create_store(namespace, url=None, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, record=None):
+    url = url or os.getenv('SESSION_STORE', 'memory')
+    if url == 'memory':
+        return MemoryStore(namespace, ttl=ttl, max_entries=max_entries, record=record)
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        return SQLiteStore(namespace, path, ttl=ttl, max_entries=max_entries, record=record)
+    raise ValueError(f"Unsupported SESSION_STORE: {url}")
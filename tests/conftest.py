@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 專案內的 copy.py 會蓋掉標準函式庫的 copy，專案目錄要放在 sys.path 最後面
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpen, OPEN, CLOSED
+
+
+def failing():
+    raise RuntimeError("upstream down")
+
+
+def test_trips_after_error_rate():
+    breaker = CircuitBreaker("test", window=4, min_calls=4, error_rate=0.5, reset_timeout=60)
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            breaker.call(failing)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: "ok")
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_in_flight_failures_after_trip_do_not_trip_again():
+    # Yahoo 變慢時很多呼叫卡到逾時才失敗，跳開後才回來的結果不能再跳開一次、重設 opened_at
+    breaker = CircuitBreaker("test", window=4, min_calls=4, error_rate=0.5, reset_timeout=60)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def hanging():
+        started.release()
+        release.wait()
+        raise RuntimeError("timed out")
+
+    def call_hanging():
+        try:
+            breaker.call(hanging)
+        except RuntimeError:
+            pass
+
+    threads = [threading.Thread(target=call_hanging) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        started.acquire()
+
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            breaker.call(failing)
+    assert breaker.state == OPEN
+    opened_at = breaker.opened_at
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert breaker.state == OPEN
+    assert breaker.opened_at == opened_at
+    assert breaker.stats()["trips"] == 1
+
+
+def test_stale_success_does_not_close_half_open_breaker():
+    breaker = CircuitBreaker("test", window=2, min_calls=2, error_rate=0.5, reset_timeout=0)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_ok():
+        started.set()
+        release.wait()
+        return "ok"
+
+    thread = threading.Thread(target=breaker.call, args=(slow_ok,))
+    thread.start()
+    started.wait()
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            breaker.call(failing)
+    assert breaker.state == OPEN
+
+    release.set()
+    thread.join()
+    # 舊的成功結果不算試探；下一個呼叫才是真正的試探，失敗就再跳開
+    assert breaker.state == OPEN
+    with pytest.raises(RuntimeError):
+        breaker.call(failing)
+    assert breaker.state == OPEN
+    assert breaker.stats()["trips"] == 2
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# 有 TTL 與 LRU 上限的快取；稍微過期的資料先回給使用者，同時在背景更新
+class TTLCache:
+    def __init__(self, name, ttl=60, stale_ttl=300, max_entries=256):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.stale_hits = Counter()
+        self.misses = Counter()
+        self.refresh_errors = Counter()
+        # 同一個 key 同時 miss 時只載入一次
+        self._flight = SingleFlight(name)
+
+    def _lookup(self, key, loader, now):
+        # 回傳 (是否命中, 值)；稍微過期的資料算命中，並在背景更新
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = now - stored_at
+            if age < self.ttl:
+                self.hits.inc()
+                return True, value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits.inc()
+                self._refresh_in_background(key, loader)
+                return True, value
+        self.misses.inc()
+        return False, None
+
+    def get(self, key, loader):
+        found, value = self._lookup(key, loader, time.monotonic())
+        if found:
+            return value
+        return self._flight.do(key, self._load, key, loader)
+
+    def _load(self, key, loader):
+        value = loader(key)
+        self.set(key, value)
+        return value
+
+    def get_many(self, keys, loader):
+        # loader 接收 key 的 list 並回傳 {key: value}，所有沒命中的 key 只呼叫一次 loader
+        def load_one(key):
+            return loader([key]).get(key)
+
+        now = time.monotonic()
+        values = {}
+        missing = []
+        for key in keys:
+            found, value = self._lookup(key, load_one, now)
+            if found:
+                values[key] = value
+            else:
+                missing.append(key)
+        if missing:
+            values.update(self._flight.do(tuple(missing), self._load_many, missing, loader))
+        return values
+
+    def _load_many(self, keys, loader):
+        loaded = loader(keys)
+        values = {key: loaded.get(key) for key in keys}
+        for key, value in values.items():
+            self.set(key, value)
+        return values
+
+    def peek(self, key):
+        # 只讀快取，不論是否過期都不觸發載入，用在限流或斷路時回舊資料
+        entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        thread = threading.Thread(target=self._refresh, args=(key, loader), daemon=True)
+        thread.start()
+
+    def _refresh(self, key, loader):
+        try:
+            self.set(key, loader(key))
+        except Exception:
+            # 更新失敗就保留舊資料，等下一次請求再試
+            self.refresh_errors.inc()
+            logger.exception("%s refresh failed for %s", self.name, key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits.value,
+            "stale_hits": self.stale_hits.value,
+            "misses": self.misses.value,
+            "refresh_errors": self.refresh_errors.value,
+            "coalesced": self._flight.coalesced.value,
+        }
@@ -0,0 +1,98 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# 背景工作池：/callback 驗證簽章後把事件丟進有上限的佇列，立即回 200 給 LINE
+# 每個執行緒有自己的佇列，相同 key（例如 user_id）的工作一定進同一個佇列，依送達順序處理
+class WorkerPool:
+    def __init__(self, name, workers=4, max_queue=100):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queues = []
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.processed = Counter()
+        self.failed = Counter()
+        self.overflow = Counter()
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+
+    def _ensure_started(self):
+        # gunicorn 會在 fork 之後才跑請求，所以執行緒要在各 worker 行程內才啟動
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            shard_size = max(1, self.max_queue // self.workers)
+            self._queues = [queue.Queue(maxsize=shard_size) for _ in range(self.workers)]
+            for i, shard in enumerate(self._queues):
+                thread = threading.Thread(target=self._run, args=(shard,), name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, func, *args, key=None):
+        self._ensure_started()
+        index = next(self._next) if key is None else hash(key)
+        try:
+            self._queues[index % self.workers].put_nowait((time.monotonic(), func, args))
+            return True
+        except queue.Full:
+            # 佇列滿了就在目前的請求裡直接處理，避免事件遺失（此時不保證同一個 key 的順序）
+            self.overflow.inc()
+            logger.warning("%s queue full, running inline", self.name)
+            self._call(func, args)
+            return False
+
+    def map(self, func, items, key):
+        # 把一批工作依 key 分散到各執行緒並等待全部完成，不能在本工作池的執行緒裡呼叫
+        done = threading.Semaphore(0)
+
+        def task(item):
+            try:
+                func(item)
+            finally:
+                done.release()
+
+        for item in items:
+            self.submit(task, item, key=key(item))
+        for _ in items:
+            done.acquire()
+
+    def _run(self, shard):
+        while True:
+            enqueued_at, func, args = shard.get()
+            self.wait_time.observe(time.monotonic() - enqueued_at)
+            self._call(func, args)
+            shard.task_done()
+
+    def _call(self, func, args):
+        with self.run_time.time():
+            try:
+                func(*args)
+                self.processed.inc()
+            except Exception:
+                self.failed.inc()
+                logger.exception("%s task failed", self.name)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_depth": sum(shard.qsize() for shard in self._queues),
+            "max_queue": self.max_queue,
+            "processed": self.processed.value,
+            "failed": self.failed.value,
+            "overflow": self.overflow.value,
+            "wait_time": self.wait_time.snapshot(),
+            "run_time": self.run_time.snapshot(),
+        }